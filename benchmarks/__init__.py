@@ -0,0 +1 @@
+"""Offline benchmarks of the Telegram to SMS cycle running against local fakes."""
@@ -0,0 +1,146 @@
+"""Module with local HTTP stub of SMSC API send, status and balance commands."""
+
+import asyncio
+import json
+import logging
+import random
+from collections import Counter
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger('benchmarks.fake_smsc')
+
+SEGMENT_COST = 1.5
+
+
+class FakeSMSCServer(object):
+    """Keep-alive HTTP server answering SMSC API commands with configurable latency and error rate."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None) -> None:
+        """Initialize FakeSMSCServer object.
+
+        Args:
+            latency: delay in seconds before every answer.
+            error_rate: share of requests answered with HTTP 503.
+            seed: seed of the error generator.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests: Counter[str] = Counter()
+        self.errors = 0
+        self.sent_messages = 0
+        self._random = random.Random(seed)
+        self._next_message_id = 1
+        self._sent_ids: set[tuple[str, str]] = set()
+        self._server: Optional[asyncio.Server] = None
+
+    @property
+    def host(self) -> str:
+        """Get host and port the server listens on.
+
+        Returns:
+            Host name with port usable as SMSC mirror.
+
+        Raises:
+            RuntimeError: if the server is not started.
+        """
+        if self._server is None:
+            raise RuntimeError('Fake SMSC server is not started')
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f'{host}:{port}'
+
+    async def start(self) -> None:
+        """Start listening on a free local port."""
+        self._server = await asyncio.start_server(self._handle_connection, '127.0.0.1', 0)
+
+    async def close(self) -> None:
+        """Stop the server."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer requests of one keep-alive connection.
+
+        Args:
+            reader: client stream reader.
+            writer: client stream writer.
+        """
+        try:
+            while request_line := await reader.readline():
+                method, target = request_line.decode().split(' ')[:2]
+                content_length = 0
+                while (header_line := await reader.readline()).strip():
+                    name, _, header_value = header_line.decode().partition(':')
+                    if name.strip().lower() == 'content-length':
+                        content_length = int(header_value)
+                body = await reader.readexactly(content_length) if content_length else b''
+                url = urlsplit(target)
+                query = parse_qs(body.decode() if method == 'POST' else url.query)
+                status, payload = await self._answer(url.path, {name: values[0] for name, values in query.items()})
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n'
+                    f'Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n'.encode() + payload,
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, path: str, arguments: dict[str, str]) -> tuple[str, bytes]:
+        """Build answer of the API command.
+
+        Args:
+            path: request path.
+            arguments: request arguments.
+
+        Returns:
+            HTTP status line part and response body.
+        """
+        command = path.rsplit('/', 1)[-1].removesuffix('.php')
+        self.requests[command] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return '503 Service Unavailable', b''
+        if command == 'send':
+            return '200 OK', self._send(arguments).encode()
+        if command == 'status':
+            if (arguments.get('id', ''), arguments.get('phone', '')) not in self._sent_ids:
+                return '200 OK', b'0,-3'
+            return '200 OK', f'1,{int(asyncio.get_running_loop().time())},0'.encode()
+        if command == 'balance':
+            return '200 OK', b'1000000.00'
+        return '404 Not Found', b''
+
+    def _send(self, arguments: dict[str, str]) -> str:
+        """Answer send command in plain text or list mode json.
+
+        Args:
+            arguments: request arguments.
+
+        Returns:
+            Response body.
+        """
+        if arguments.get('cost') == '1':
+            return f'{SEGMENT_COST},1'
+        message_id: int | str = arguments.get('id', '0')
+        if message_id == '0':
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        if arguments.get('op') == '1':
+            phones = [line.partition(':')[0] for line in arguments.get('list', '').split('\n') if line]
+            self._sent_ids.update((str(message_id), phone) for phone in phones)
+            self.sent_messages += len(phones)
+            return json.dumps({
+                'id': message_id,
+                'cnt': len(phones),
+                'cost': str(SEGMENT_COST * len(phones)),
+                'phones': [{'phone': phone, 'cnt': 1, 'cost': str(SEGMENT_COST)} for phone in phones],
+            })
+        phones = arguments.get('phones', '').split(',')
+        self._sent_ids.update((str(message_id), phone) for phone in phones)
+        self.sent_messages += len(phones)
+        return f'{message_id},1,{SEGMENT_COST},1000000.00'
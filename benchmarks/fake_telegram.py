@@ -0,0 +1,144 @@
+"""Module with synthetic Telegram dialogs standing in for TelegramClient."""
+
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import AsyncIterator, Optional
+
+WORDS = (
+    'news', 'update', 'market', 'release', 'weather', 'report', 'city', 'price', 'team', 'match', 'новости',
+    'погода', 'рынок', 'выпуск', 'город', 'цена', 'команда', 'матч', 'https://example.com/post', '🔥',
+)
+
+
+class FakeMessage(object):
+    """Telegram message with the attributes used by harvesting."""
+
+    def __init__(self, message_id: int, text: str, date: datetime) -> None:
+        """Initialize FakeMessage object.
+
+        Args:
+            message_id: message id within the dialog.
+            text: message text.
+            date: message timestamp.
+        """
+        self.id = message_id
+        self.text = text
+        self.date = date
+        self.fwd_from = None
+        self.out = False
+
+
+class FakeDialog(object):
+    """Telegram dialog with the given number of unread messages."""
+
+    def __init__(self, dialog_id: int, title: str, unread_count: int) -> None:
+        """Initialize FakeDialog object.
+
+        Args:
+            dialog_id: marked dialog id.
+            title: dialog title.
+            unread_count: number of unread messages, all messages of the dialog are unread.
+        """
+        self.id = dialog_id
+        self.name = title
+        self.entity = SimpleNamespace(title=title)
+        self.unread_count = unread_count
+        self.pinned = False
+        self.dialog = SimpleNamespace(read_inbox_max_id=0)
+        self.message = SimpleNamespace(id=unread_count) if unread_count else None
+
+
+class FakeTelegramClient(object):
+    """Client generating dialog messages lazily, so the fake itself does not hold the backlog in memory."""
+
+    def __init__(self, messages_count: int, dialogs_count: int, message_length: int = 300, seed: int = 0) -> None:
+        """Initialize FakeTelegramClient object spreading the messages over the dialogs.
+
+        Args:
+            messages_count: total number of unread messages.
+            dialogs_count: number of dialogs.
+            message_length: average message length in chars.
+            seed: seed of the text generator.
+        """
+        self.message_length = message_length
+        self.seed = seed
+        self.started_at = datetime.now(timezone.utc)
+        per_dialog, rest = divmod(messages_count, dialogs_count)
+        self.dialogs = [
+            FakeDialog(-1000000000000 - index, f'Channel {index}', per_dialog + (1 if index < rest else 0))
+            for index in range(dialogs_count)
+        ]
+        self.read_acknowledged: dict[str, int] = {}
+
+    async def iter_dialogs(self) -> AsyncIterator[FakeDialog]:
+        """Iterate over all dialogs.
+
+        Yields:
+            Dialogs.
+        """
+        for dialog in self.dialogs:
+            yield dialog
+
+    async def iter_messages(
+        self, entity: SimpleNamespace, min_id: int = 0, reverse: bool = False, limit: Optional[int] = None,
+    ) -> AsyncIterator[FakeMessage]:
+        """Iterate over dialog messages newer than min_id.
+
+        Args:
+            entity: dialog entity.
+            min_id: id of the last message that is not returned.
+            reverse: whether to iterate from the oldest message.
+            limit: maximum number of messages.
+
+        Yields:
+            Generated messages.
+        """
+        dialog = next(dialog for dialog in self.dialogs if dialog.entity is entity)
+        message_ids = range(min_id + 1, dialog.unread_count + 1)
+        for count, message_id in enumerate(message_ids if reverse else reversed(message_ids)):
+            if limit is not None and count >= limit:
+                return
+            yield self._message(dialog, message_id)
+
+    async def get_messages(
+        self, entity: SimpleNamespace, limit: Optional[int] = None, min_id: int = 0,
+    ) -> list[FakeMessage]:
+        """Get dialog messages newer than min_id from the newest one.
+
+        Args:
+            entity: dialog entity.
+            limit: maximum number of messages.
+            min_id: id of the last message that is not returned.
+
+        Returns:
+            Generated messages.
+        """
+        return [message async for message in self.iter_messages(entity, min_id=min_id, limit=limit)]
+
+    async def send_read_acknowledge(self, entity: SimpleNamespace, max_id: int) -> None:
+        """Remember the last read message of the dialog.
+
+        Args:
+            entity: dialog entity.
+            max_id: id of the last read message.
+        """
+        self.read_acknowledged[entity.title] = max_id
+
+    def _message(self, dialog: FakeDialog, message_id: int) -> FakeMessage:
+        """Generate message deterministically from its dialog and id.
+
+        Args:
+            dialog: message dialog.
+            message_id: message id.
+
+        Returns:
+            Generated message.
+        """
+        text_random = random.Random(f'{self.seed}:{dialog.id}:{message_id}')
+        words: list[str] = []
+        length = text_random.randint(self.message_length // 2, self.message_length * 3 // 2)
+        while sum(map(len, words)) + len(words) < length:
+            words.append(text_random.choice(WORDS))
+        date = self.started_at - timedelta(seconds=dialog.unread_count - message_id)
+        return FakeMessage(message_id, f'{message_id}. {" ".join(words)}', date)
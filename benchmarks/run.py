@@ -0,0 +1,202 @@
+"""Module running the harvest and send cycle against local fakes and saving throughput, memory and time as JSON."""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Optional
+
+from benchmarks.fake_smsc import FakeSMSCServer
+from benchmarks.fake_telegram import FakeTelegramClient
+from core.async_smsc import AsyncSMSC
+from core.budget import CostModel
+from core.choices import SegmentStatus, SendingMode
+from core.classes import SMSController, TelegramController
+from core.dedup import ContentDeduplicator
+from core.mirrors import MirrorSelector
+from core.outbox import Outbox
+from core.rate_limit import TokenBucket
+from core.settings import STORAGE_DIR
+from core.state import WatermarkStore
+
+logger = logging.getLogger('benchmarks.run')
+
+DEFAULT_SIZES = (500, 2000, 10000)
+DEFAULT_OUTPUT_PATH = os.path.join(STORAGE_DIR, 'benchmark_results.json')
+MAX_SEND_ROUNDS = 50
+UNLIMITED_RATE = 1e9
+
+
+async def run_cycle(
+    messages_count: int,
+    dialogs_count: int,
+    server: FakeSMSCServer,
+    sending_mode: SendingMode,
+    burst: int,
+    trace_memory: bool = False,
+) -> dict[str, Any]:
+    """Harvest the synthetic backlog into a temporary outbox and send it to the fake SMSC.
+
+    Tracing allocations slows the cycle down several times, so times of a cycle with traced memory are not
+    representative and memory is measured in a separate cycle.
+
+    Args:
+        messages_count: number of unread messages.
+        dialogs_count: number of dialogs the messages are spread over.
+        server: started fake SMSC server.
+        sending_mode: SMS sending mode.
+        burst: rate limiter capacity, it bounds the batch size.
+        trace_memory: whether to trace allocations to measure the peak memory.
+
+    Returns:
+        Measurements of the cycle, peak memory is None when it is not traced.
+    """
+    requests_before, errors_before, sent_before = sum(server.requests.values()), server.errors, server.sent_messages
+    with tempfile.TemporaryDirectory() as temp_dir:
+        state_db_path = os.path.join(temp_dir, 'state.sqlite3')
+        outbox = Outbox(os.path.join(temp_dir, 'outbox.sqlite3'))
+        watermark_store = WatermarkStore(state_db_path)
+        deduplicator = ContentDeduplicator(state_db_path)
+        smsc_client = AsyncSMSC(selector=MirrorSelector((server.host,)))
+        sms_controller = SMSController(
+            sending_mode=sending_mode,
+            outbox=outbox,
+            rate_limiter=TokenBucket(UNLIMITED_RATE, burst),
+            smtp_fallback=False,
+            smsc_client=smsc_client,
+            cost_model=CostModel(smsc_client, state_db_path),
+        )
+        peak_memory: Optional[int] = None
+        if trace_memory:
+            tracemalloc.start()
+        started_at = perf_counter()
+        try:
+            await TelegramController._save_unread_messages(
+                FakeTelegramClient(messages_count, dialogs_count), watermark_store, outbox, deduplicator,
+            )
+            harvested_at = perf_counter()
+            segments_count = outbox.pending_count()
+            send_rounds = 0
+            while outbox.pending_count() and send_rounds < MAX_SEND_ROUNDS:
+                await sms_controller.send_messages()
+                send_rounds += 1
+            finished_at = perf_counter()
+            if trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            status_counts = outbox.status_counts()
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            watermark_store.close()
+            deduplicator.close()
+            await sms_controller.close()
+    send_seconds = finished_at - harvested_at
+    accepted_count = status_counts[SegmentStatus.sent] + status_counts[SegmentStatus.delivered]
+    return {
+        'messages': messages_count,
+        'dialogs': dialogs_count,
+        'segments': segments_count,
+        'unsent_segments': segments_count - accepted_count,
+        'failed_segments': status_counts[SegmentStatus.failed],
+        'send_rounds': send_rounds,
+        'harvest_seconds': harvested_at - started_at,
+        'send_seconds': send_seconds,
+        'wall_seconds': finished_at - started_at,
+        'messages_per_second': messages_count / (harvested_at - started_at),
+        'segments_per_second': accepted_count / send_seconds if send_seconds else None,
+        'peak_memory_mb': None if peak_memory is None else peak_memory / 2 ** 20,
+        'smsc_requests': sum(server.requests.values()) - requests_before,
+        'smsc_errors': server.errors - errors_before,
+        'smsc_sent_messages': server.sent_messages - sent_before,
+    }
+
+
+async def run_benchmarks(arguments: argparse.Namespace) -> dict[str, Any]:
+    """Run the timed cycle and the memory cycle for every backlog size against one fake SMSC server.
+
+    Args:
+        arguments: parsed command line arguments.
+
+    Returns:
+        Run parameters and measurements per backlog size.
+    """
+    server = FakeSMSCServer(arguments.latency, arguments.error_rate, arguments.seed)
+    await server.start()
+    results = []
+    try:
+        for messages_count in arguments.sizes:
+            result = await run_cycle(
+                messages_count, arguments.dialogs, server, arguments.sending_mode, arguments.burst,
+            )
+            if arguments.measure_memory:
+                memory_result = await run_cycle(
+                    messages_count, arguments.dialogs, server, arguments.sending_mode, arguments.burst, True,
+                )
+                result['peak_memory_mb'] = memory_result['peak_memory_mb']
+            peak_memory = '' if result['peak_memory_mb'] is None else f', {result["peak_memory_mb"]:.1f} MB peak'
+            logger.info(
+                f'{messages_count} messages: {result["wall_seconds"]:.2f}s wall, '
+                f'{result["messages_per_second"]:.0f} messages/s{peak_memory}',
+            )
+            results.append(result)
+    finally:
+        await server.close()
+    return {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': {
+            'sizes': arguments.sizes,
+            'dialogs': arguments.dialogs,
+            'latency': arguments.latency,
+            'error_rate': arguments.error_rate,
+            'sending_mode': arguments.sending_mode.value,
+            'burst': arguments.burst,
+            'measure_memory': arguments.measure_memory,
+        },
+        'results': results,
+    }
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parse command line arguments.
+
+    Returns:
+        Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the Telegram to SMS cycle against local fakes.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='backlog sizes in messages')
+    parser.add_argument('--dialogs', type=int, default=20, help='number of dialogs the backlog is spread over')
+    parser.add_argument('--latency', type=float, default=0.005, help='fake SMSC answer delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of fake SMSC answers with HTTP 503')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the fake SMSC errors')
+    parser.add_argument(
+        '--sending-mode', type=SendingMode, choices=list(SendingMode), default=SendingMode.batch, help='sending mode',
+    )
+    parser.add_argument('--burst', type=int, default=100, help='rate limiter capacity bounding the batch size')
+    parser.add_argument(
+        '--no-memory', dest='measure_memory', action='store_false', help='skip the cycle measuring peak memory',
+    )
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_PATH, help='path of the JSON results file')
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.getLogger('core').setLevel(logging.WARNING)
+    arguments = parse_arguments()
+    report = asyncio.run(run_benchmarks(arguments))
+    os.makedirs(os.path.dirname(os.path.abspath(arguments.output)), exist_ok=True)
+    with open(arguments.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    logger.info(f'Results saved to {arguments.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Module with adapters for i/o operations."""
+
+import logging
+from typing import Any, Optional
+
+import yaml
+
+logger = logging.getLogger('core.adapters')
+
+
+class BaseAdapter(object):
+    """Base adapter class."""
+
+    def write(self, content: Any) -> Any:
+        """Write data to destination.
+
+        Args:
+            content: data to be written.
+        """
+        pass
+
+    def read(self) -> Any:
+        """Read data from a data source."""
+        pass
+
+
+class FileAdapter(BaseAdapter):
+    """Adapter class for i/o file operations."""
+
+    def __init__(self, file_path: str) -> None:
+        """Initialize FileAdapter object.
+
+        Args:
+            file_path: path to file for write and read operations.
+        """
+        self.file_path = file_path
+
+    def write(self, content: str) -> None:
+        """Write data to a file.
+
+        Args:
+            content: data to be written to the file.
+        """
+        try:
+            with open(self.file_path, 'w') as file_obj:
+                file_obj.write(content)
+        except FileNotFoundError as file_error:
+            error_message = f'FileNotFoundError. Create folders first. Error: {file_error}'
+        else:
+            return None
+        logger.error(error_message)
+        return None
+
+    def read(self) -> Optional[str]:
+        """Read data from a file.
+
+        Returns:
+            Reading file content.
+        """
+        try:
+            with open(self.file_path, 'r') as file_obj:
+                file_content = file_obj.read()
+        except FileNotFoundError as file_error:
+            error_message = f'FileNotFoundError. File with specified path not exists. Error: {file_error}'
+        else:
+            return file_content
+        logger.error(error_message)
+        return None
+
+
+class YamlFileAdapter(BaseAdapter):
+    """Adapter class for i/o yaml file operations."""
+
+    def __init__(self, file_path: str) -> None:
+        """Initialize YamlFileAdapter object.
+
+        Args:
+            file_path: path to yaml file for write and read operations.
+        """
+        self.file_path = file_path
+
+    def write(self, content: bytes) -> None:
+        """Write data to a yaml file.
+
+        Args:
+            content: data to be written to the yaml file.
+        """
+        try:
+            with open(self.file_path, 'wb') as file_obj:
+                yaml.safe_dump(content, file_obj)
+        except FileNotFoundError as file_error:
+            error_message = f'FileNotFoundError. Create folders first. Error: {file_error}'
+        except yaml.YAMLError as yaml_error:
+            error_message = f'YAMLError. YAML parser encounters an error condition. Error: {yaml_error}'
+        else:
+            return None
+        logger.error(error_message)
+        return None
+
+    def read(self) -> Optional[dict]:
+        """Read data from a yaml file.
+
+        Returns:
+            Reading yaml file content.
+        """
+        try:
+            with open(self.file_path, 'r') as file_obj:
+                file_content = yaml.safe_load(file_obj)
+        except FileNotFoundError as file_error:
+            error_message = f'FileNotFoundError. File with specified path not exists. Error: {file_error}'
+        except yaml.YAMLError as yaml_error:
+            error_message = f'YAMLError. YAML parser encounters an error condition. Error: {yaml_error}'
+        else:
+            return file_content
+        logger.error(error_message)
+        return None
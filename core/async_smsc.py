@@ -0,0 +1,594 @@
+"""Module with asyncio SMSC API client working over pooled keep-alive connections."""
+
+import asyncio
+import json
+import logging
+import ssl
+from collections import Counter, defaultdict
+from time import monotonic
+from typing import NamedTuple, Optional, Sequence
+from urllib.parse import quote, urlsplit
+
+from core.exceptions import (
+    HTTPConnectError, SMSCPermanentError, SMSCRequestSentError, SMSCTimeoutError, SMSCTransientError,
+)
+from core.metrics import smsc_request_errors, smsc_request_seconds, smsc_retries
+from core.mirrors import MirrorSelector, mirror_selector
+from core.settings import SMSC_CONNECT_TIMEOUT, SMSC_MAX_CONNECTIONS, SMSC_READ_TIMEOUT
+from core.smsc_api import SMSC_CHARSET, SMSC_HTTPS, SMSC_POST, smsc_credentials
+
+logger = logging.getLogger('core.async_smsc')
+
+SMS_FORMATS = ('flash=1', 'push=1', 'hlr=1', 'bin=1', 'bin=2', 'ping=1', 'mms=1', 'mail=1', 'call=1', 'viber=1', 'soc=1')
+GET_URL_LENGTH_LIMIT = 2000
+TRANSIENT_ERROR_CODES = frozenset((9,))
+ACCOUNT_ERROR_CODES = frozenset((2, 3, 4))
+
+ConnectionKey = tuple[str, int, bool]
+Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class SendResult(NamedTuple):
+    """Result of sending one message in SMSC list mode."""
+
+    message_id: str
+    phone: str
+    sms_count: int
+    cost: float
+    error_code: int
+    piece: int = 0
+
+    @property
+    def piece_id(self) -> str:
+        """Identify the message among all messages of the request, they share the request message id.
+
+        Returns:
+            Request message id and position of the message among the request messages to the same phone.
+        """
+        return f'{self.message_id}:{self.piece}'
+
+
+def is_transient_error_code(error_code: int) -> bool:
+    """Check whether SMSC API error code is worth retrying later.
+
+    Args:
+        error_code: positive SMSC API error code.
+
+    Returns:
+        True for too frequent requests error.
+    """
+    return error_code in TRANSIENT_ERROR_CODES
+
+
+def is_account_error_code(error_code: int) -> bool:
+    """Check whether SMSC API error code rejects the whole account rather than one message.
+
+    Args:
+        error_code: positive SMSC API error code.
+
+    Returns:
+        True for wrong credentials, insufficient funds and blocked IP errors.
+    """
+    return error_code in ACCOUNT_ERROR_CODES
+
+
+def build_sms_list(messages: Sequence[tuple[str, str]]) -> str:
+    """Build value of the SMSC list argument.
+
+    Args:
+        messages: pairs of receiver phone number and message text.
+
+    Returns:
+        Lines of phone:message pairs with escaped line breaks.
+    """
+    return '\n'.join(f'{phone}:{text}'.replace('\r', '').replace('\n', '\\n') for phone, text in messages)
+
+
+def parse_sms_list_response(response: str, messages: Sequence[tuple[str, str]]) -> list[SendResult]:
+    """Parse SMSC json response of the list mode send request.
+
+    Args:
+        response: raw json response.
+        messages: pairs of receiver phone number and message text sent with the request.
+
+    Returns:
+        Send result for every message numbered among the messages to its phone, failed results have positive
+        error code.
+    """
+    try:
+        response_data = json.loads(response) if response else {}
+    except ValueError:
+        logger.error(f'Unexpected SMSC list response: {response!r}')
+        response_data = {}
+    message_id = str(response_data.get('id', ''))
+    error_code = int(response_data.get('error_code', 0 if response_data else -1))
+    phones_data = response_data.get('phones') or []
+    results = []
+    phone_pieces: Counter[str] = Counter()
+    for index, (phone, _) in enumerate(messages):
+        phone_data = phones_data[index] if index < len(phones_data) else {}
+        results.append(SendResult(
+            message_id=message_id,
+            phone=phone,
+            sms_count=int(phone_data.get('cnt', phone_data.get('sms', 0)) or 0),
+            cost=float(phone_data.get('cost', 0) or 0),
+            error_code=int(phone_data.get('error', error_code) or 0),
+            piece=phone_pieces[phone],
+        ))
+        phone_pieces[phone] += 1
+    return results
+
+
+class HTTPConnectionPool(object):
+    """Pool of HTTP/1.1 keep-alive connections with bounded concurrency."""
+
+    def __init__(
+        self,
+        max_connections: int = SMSC_MAX_CONNECTIONS,
+        connect_timeout: float = SMSC_CONNECT_TIMEOUT,
+        read_timeout: float = SMSC_READ_TIMEOUT,
+    ) -> None:
+        """Initialize HTTPConnectionPool object.
+
+        Args:
+            max_connections: maximum number of simultaneously running requests.
+            connect_timeout: timeout in seconds for opening a connection.
+            read_timeout: timeout in seconds for a whole request/response exchange.
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._idle_connections: dict[ConnectionKey, list[Connection]] = defaultdict(list)
+
+    async def request(
+        self, method: str, url: str, body: Optional[bytes] = None, idempotent: bool = True,
+    ) -> tuple[int, bytes]:
+        """Make HTTP request reusing an idle connection to the host when possible.
+
+        Args:
+            method: HTTP method name.
+            url: absolute request url.
+            body: optional request body.
+            idempotent: whether the request may be repeated on a fresh connection when a reused one breaks.
+
+        Returns:
+            Response status code and response body.
+
+        Raises:
+            HTTPConnectError: connection to the host cannot be opened, the request was not sent.
+        """
+        split_url = urlsplit(url)
+        is_https = split_url.scheme == 'https'
+        key = (split_url.hostname or '', split_url.port or (443 if is_https else 80), is_https)
+        target = split_url.path + (f'?{split_url.query}' if split_url.query else '')
+        async with self._semaphore:
+            connection, is_reused = await self._acquire(key)
+            try:
+                status, payload, keep_alive = await asyncio.wait_for(
+                    self._exchange(connection, method, key[0], target, body), timeout=self.read_timeout,
+                )
+            except (ConnectionError, asyncio.IncompleteReadError) as connection_error:
+                self._close(connection)
+                if not is_reused or not idempotent:
+                    raise
+                logger.debug(f'Stale keep-alive connection to {key[0]} dropped: {connection_error!r}')
+                connection, _ = await self._acquire(key, reuse=False)
+                try:
+                    status, payload, keep_alive = await asyncio.wait_for(
+                        self._exchange(connection, method, key[0], target, body), timeout=self.read_timeout,
+                    )
+                except BaseException:
+                    self._close(connection)
+                    raise
+            except BaseException:
+                self._close(connection)
+                raise
+            if keep_alive:
+                self._idle_connections[key].append(connection)
+            else:
+                self._close(connection)
+        return status, payload
+
+    async def close(self) -> None:
+        """Close all idle connections of the pool."""
+        for connections in self._idle_connections.values():
+            for connection in connections:
+                self._close(connection)
+        self._idle_connections.clear()
+
+    async def _acquire(self, key: ConnectionKey, reuse: bool = True) -> tuple[Connection, bool]:
+        """Get idle connection for the host or open a new one.
+
+        Args:
+            key: host, port and https flag of the connection.
+            reuse: whether idle connections may be reused.
+
+        Returns:
+            Connection and flag whether it was taken from the idle pool.
+
+        Raises:
+            HTTPConnectError: connection cannot be opened or timed out.
+        """
+        idle_connections = self._idle_connections[key]
+        while reuse and idle_connections:
+            reader, writer = idle_connections.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+        host, port, is_https = key
+        try:
+            connection = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=ssl.create_default_context() if is_https else None),
+                timeout=self.connect_timeout,
+            )
+        except (OSError, asyncio.TimeoutError) as connect_error:
+            raise HTTPConnectError(f'Cannot connect to {host}:{port}: {connect_error!r}') from connect_error
+        return connection, False
+
+    @staticmethod
+    def _close(connection: Connection) -> None:
+        """Close the connection transport.
+
+        Args:
+            connection: connection to be closed.
+        """
+        connection[1].close()
+
+    @staticmethod
+    async def _exchange(
+        connection: Connection, method: str, host: str, target: str, body: Optional[bytes],
+    ) -> tuple[int, bytes, bool]:
+        """Write HTTP request and read the whole response from the connection.
+
+        Args:
+            connection: opened connection.
+            method: HTTP method name.
+            host: value of the Host header.
+            target: request path with query string.
+            body: optional request body.
+
+        Returns:
+            Response status code, response body and flag whether the connection can be reused.
+        """
+        reader, writer = connection
+        headers = [f'{method} {target} HTTP/1.1', f'Host: {host}', 'Connection: keep-alive']
+        if body is not None:
+            headers.extend(['Content-Type: application/x-www-form-urlencoded', f'Content-Length: {len(body)}'])
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            header_line = await reader.readline()
+            if header_line in {b'\r\n', b'\n', b''}:
+                break
+            name, _, header_value = header_line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = header_value.strip().lower()
+
+        keep_alive = response_headers.get('connection') != 'close' and not status_line.startswith(b'HTTP/1.0')
+        if response_headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                chunk_size = int((await reader.readline()).split(b';')[0], 16)
+                if not chunk_size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(chunk_size))
+                await reader.readexactly(2)
+            payload = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            payload = await reader.readexactly(int(response_headers['content-length']))
+        else:
+            payload = await reader.read()
+            keep_alive = False
+        return status, payload, keep_alive
+
+
+class AsyncSMSC(object):
+    """Non-blocking SMSC API client with the same surface as core.smsc_api.SMSC."""
+
+    def __init__(self, pool: Optional[HTTPConnectionPool] = None, selector: MirrorSelector = mirror_selector) -> None:
+        """Initialize AsyncSMSC object.
+
+        Args:
+            pool: connection pool to use, a new one is created by default.
+            selector: mirror selector shared by SMSC clients of the process.
+        """
+        self.pool = pool or HTTPConnectionPool()
+        self.selector = selector
+
+    async def __aenter__(self) -> 'AsyncSMSC':
+        """Enter async context manager.
+
+        Returns:
+            AsyncSMSC instance.
+        """
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Close pooled connections on context manager exit.
+
+        Args:
+            exc_info: exception info.
+        """
+        await self.close()
+
+    async def close(self) -> None:
+        """Close pooled connections."""
+        await self.pool.close()
+
+    async def send_sms(
+        self,
+        phones: str,
+        message: str,
+        translit: int = 0,
+        time: str = '',
+        message_id: int = 0,
+        message_format: int = 0,
+        sender: Optional[str] = None,
+        query: str = '',
+    ) -> list[str]:
+        """Send SMS message.
+
+        Args:
+            phones: phone numbers separated by comma or semicolon.
+            message: message text.
+            translit: transliteration mode (0, 1 or 2).
+            time: required delivery time.
+            message_id: message identifier, assigned by SMSC when 0.
+            message_format: message format, 0 is a regular sms.
+            sender: sender id.
+            query: additional url query parameters.
+
+        Returns:
+            List (<id>, <sms count>, <cost>, <balance>) on success or (<id>, -<error code>) on failure.
+        """
+        arg = (
+            f'cost=3&phones={quote(phones)}&mes={quote(message)}&translit={translit}&id={message_id}'
+            f'{self._format_arg(message_format)}{self._optional_arg("sender", sender)}'
+            f'{self._optional_arg("time", time)}{f"&{query}" if query else ""}'
+        )
+        return await self._smsc_send_cmd('send', arg)
+
+    async def send_sms_list(
+        self,
+        messages: Sequence[tuple[str, str]],
+        translit: int = 0,
+        sender: Optional[str] = None,
+        message_id: int = 0,
+    ) -> list[SendResult]:
+        """Send many messages in a single request using SMSC list mode.
+
+        Args:
+            messages: pairs of receiver phone number and message text.
+            translit: transliteration mode (0, 1 or 2).
+            sender: sender id.
+            message_id: identifier of the request messages, assigned by SMSC when 0.
+
+        Returns:
+            Send result for every message in the order of passed messages.
+        """
+        arg = (
+            f'cost=3&op=1&list={quote(build_sms_list(messages))}&translit={translit}&id={message_id}'
+            f'{self._optional_arg("sender", sender)}'
+        )
+        response = await self._smsc_request('send', arg, response_format=3, force_post=True)
+        return parse_sms_list_response(response, messages)
+
+    async def get_sms_cost(
+        self,
+        phones: str,
+        message: str,
+        translit: int = 0,
+        message_format: int = 0,
+        sender: Optional[str] = None,
+        query: str = '',
+    ) -> list[str]:
+        """Get SMS message cost without sending it.
+
+        Args:
+            phones: phone numbers separated by comma or semicolon.
+            message: message text.
+            translit: transliteration mode (0, 1 or 2).
+            message_format: message format, 0 is a regular sms.
+            sender: sender id.
+            query: additional url query parameters.
+
+        Returns:
+            List (<cost>, <sms count>) on success or (0, -<error code>) on failure.
+        """
+        arg = (
+            f'cost=1&phones={quote(phones)}&mes={quote(message)}{self._optional_arg("sender", sender)}'
+            f'&translit={translit}{self._format_arg(message_format)}{f"&{query}" if query else ""}'
+        )
+        return await self._smsc_send_cmd('send', arg, idempotent=True)
+
+    async def get_status(self, message_id: int | str, phone: str, all_info: int = 0) -> list[str]:
+        """Get status of the sent SMS message.
+
+        Args:
+            message_id: message identifier.
+            phone: receiver phone number.
+            all_info: whether to return extended information.
+
+        Returns:
+            List (<status>, <change time>, <sms error code>, ...) on success or (0, -<error code>) on failure.
+        """
+        response = await self._smsc_send_cmd(
+            'status', f'phone={quote(phone)}&id={message_id}&all={all_info}', idempotent=True,
+        )
+        if all_info and len(response) > 9 and (len(response) < 14 or response[14] != 'HLR'):
+            response = ','.join(response).split(',', 8)
+        return response
+
+    async def get_balance(self) -> Optional[str]:
+        """Get account balance.
+
+        Returns:
+            Balance or None on failure.
+        """
+        response = await self._smsc_send_cmd('balance', idempotent=True)
+        return None if len(response) > 1 else response[0]
+
+    @staticmethod
+    def _format_arg(message_format: int) -> str:
+        """Build url argument for the message format.
+
+        Args:
+            message_format: message format, 0 is a regular sms.
+
+        Returns:
+            Url argument string.
+        """
+        return f'&{SMS_FORMATS[message_format - 1]}' if message_format > 0 else ''
+
+    @staticmethod
+    def _optional_arg(name: str, arg_value: Optional[str]) -> str:
+        """Build optional url argument.
+
+        Args:
+            name: argument name.
+            arg_value: argument value, skipped when empty.
+
+        Returns:
+            Url argument string.
+        """
+        return f'&{name}={quote(str(arg_value))}' if arg_value else ''
+
+    async def _smsc_send_cmd(self, cmd: str, arg: str = '', idempotent: bool = False) -> list[str]:
+        """Call SMSC API command and split its plain text response.
+
+        Args:
+            cmd: API command name.
+            arg: url arguments of the command.
+            idempotent: whether the command can be sent to two mirrors at once.
+
+        Returns:
+            Comma separated API response split to list.
+        """
+        response = await self._smsc_request(cmd, arg, idempotent=idempotent)
+        return response.split(',')
+
+    async def _smsc_request(
+        self, cmd: str, arg: str = '', response_format: int = 1, force_post: bool = False, idempotent: bool = False,
+    ) -> str:
+        """Call SMSC API command on the fastest healthy mirror, failing over to the next ones.
+
+        Idempotent commands are also sent to the next mirror when the first one is slower than usual,
+        the first answer wins. Commands sending messages are never hedged and fail over only when the mirror
+        cannot be connected, a failure after the request was written is raised at once to avoid duplicate SMS.
+
+        Args:
+            cmd: API command name.
+            arg: url arguments of the command.
+            response_format: SMSC response format, 1 is plain text and 3 is json.
+            force_post: whether to send arguments in request body regardless of their length.
+            idempotent: whether the command can be sent to two mirrors at once or repeated after a failure.
+
+        Returns:
+            Raw API response.
+
+        Raises:
+            SMSCTransientError: all mirrors failed or timed out.
+            SMSCRequestSentError: non-idempotent command failed after it was sent.
+            SMSCPermanentError: request was rejected by the server.
+        """
+        login, password = smsc_credentials()
+        arg = (
+            f'login={quote(login)}&psw={quote(password)}&fmt={response_format}'
+            f'&charset={SMSC_CHARSET}&{arg}'
+        )
+        use_post = force_post or SMSC_POST or len(arg) > GET_URL_LENGTH_LIMIT
+        hosts = iter(self.selector.ordered_hosts())
+        pending_requests: dict[asyncio.Task, str] = {}
+        errors = []
+
+        def request_next_host() -> bool:
+            host = next(hosts, None)
+            if host is None:
+                return False
+            pending_requests[asyncio.create_task(self._request_host(host, cmd, arg, use_post, idempotent))] = host
+            return True
+
+        request_next_host()
+        try:
+            while pending_requests:
+                hedge_delay = None
+                if idempotent and len(pending_requests) == 1:
+                    hedge_delay = self.selector.hedge_delay(next(iter(pending_requests.values())))
+                done_requests, _ = await asyncio.wait(
+                    pending_requests, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done_requests:
+                    logger.info(f'SMSC {cmd} request is slow, hedging to the next mirror')
+                    if request_next_host():
+                        smsc_retries.inc(1, cmd, 'hedge')
+                    continue
+                for done_request in done_requests:
+                    host = pending_requests.pop(done_request)
+                    request_error = done_request.exception()
+                    if request_error is None:
+                        return done_request.result()
+                    if isinstance(request_error, (SMSCPermanentError, SMSCRequestSentError)):
+                        raise request_error
+                    errors.append(f'{host}: {request_error!r}')
+                    logger.warning(f'SMSC request to {host} failed: {request_error!r}')
+                if not pending_requests and request_next_host():
+                    smsc_retries.inc(1, cmd, 'failover')
+        finally:
+            for pending_request in pending_requests:
+                pending_request.cancel()
+        raise SMSCTransientError(f'All SMSC mirrors failed for {cmd} command: {"; ".join(errors)}')
+
+    async def _request_host(self, host: str, cmd: str, arg: str, use_post: bool, idempotent: bool) -> str:
+        """Call SMSC API command on one mirror, recording its latency and health.
+
+        Args:
+            host: mirror host name.
+            cmd: API command name.
+            arg: url arguments of the command.
+            use_post: whether to send arguments in request body.
+            idempotent: whether the command can be repeated after a failure.
+
+        Returns:
+            Raw API response.
+
+        Raises:
+            SMSCTimeoutError: mirror did not answer in time.
+            SMSCTransientError: network error, server error or empty response.
+            SMSCRequestSentError: non-idempotent command failed after it was sent.
+            SMSCPermanentError: request was rejected by the server.
+        """
+        url = f'{"https" if SMSC_HTTPS else "http"}://{host}/sys/{cmd}.php'
+        started_at = monotonic()
+        try:
+            if use_post:
+                status, payload = await self.pool.request('POST', url, arg.encode(SMSC_CHARSET), idempotent=idempotent)
+            else:
+                status, payload = await self.pool.request('GET', f'{url}?{arg}', idempotent=idempotent)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as request_error:
+            self.selector.record_failure(host)
+            smsc_request_errors.inc(1, host, cmd)
+            if not idempotent and not isinstance(request_error, HTTPConnectError):
+                raise SMSCRequestSentError(f'{cmd} request to {host} failed: {request_error!r}') from request_error
+            timeout_errors = (TimeoutError, asyncio.TimeoutError)
+            if isinstance(request_error, timeout_errors) or isinstance(request_error.__cause__, timeout_errors):
+                raise SMSCTimeoutError(f'{host} timed out') from request_error
+            raise SMSCTransientError(repr(request_error)) from request_error
+        latency = monotonic() - started_at
+        smsc_request_seconds.observe(latency, host, cmd)
+        if status >= 500 or not payload:
+            self.selector.record_failure(host)
+            smsc_request_errors.inc(1, host, cmd)
+            error_message = f'{host} answered {cmd} request with status {status} and {len(payload)} bytes'
+            if not idempotent:
+                raise SMSCRequestSentError(error_message)
+            raise SMSCTransientError(error_message)
+        self.selector.record_success(host, latency)
+        if status >= 400:
+            raise SMSCPermanentError(f'{host} rejected request with status {status}')
+        return payload.decode(SMSC_CHARSET)
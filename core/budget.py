@@ -0,0 +1,303 @@
+"""Module with SMS cost estimation and selection of outbox segments fitting the sending budget."""
+
+import logging
+import sqlite3
+from collections import Counter
+from dataclasses import dataclass, field
+from time import time
+from typing import NamedTuple, Optional
+
+from core.async_smsc import AsyncSMSC
+from core.exceptions import SMSCError
+from core.outbox import Outbox, PendingSegment
+from core.segmenter import count_segments, transliterate
+from core.settings import SMS_COST_CACHE_SECONDS, STATE_DB_PATH
+
+logger = logging.getLogger('core.budget')
+
+DialogRoute = tuple[Optional[int], str, Optional[str]]
+
+
+@dataclass
+class BudgetPlan(object):
+    """Segments chosen to be sent in the cycle and the skipped ones."""
+
+    selected: list[PendingSegment] = field(default_factory=list)
+    skipped: list[PendingSegment] = field(default_factory=list)
+    segments: int = 0
+    cost: float = 0
+
+
+class SegmentEstimate(NamedTuple):
+    """Estimated price of one outbox segment."""
+
+    segments: int
+    cost: float
+
+
+class CostModel(object):
+    """Local SMS cost model calibrated by SMSC cost requests and cached between runs."""
+
+    def __init__(
+        self, smsc_client: AsyncSMSC, db_path: str = STATE_DB_PATH, cache_seconds: float = SMS_COST_CACHE_SECONDS,
+    ) -> None:
+        """Initialize CostModel object.
+
+        Args:
+            smsc_client: SMSC client used for calibration requests.
+            db_path: path to SQLite database file.
+            cache_seconds: time after which the calibrated segment cost is requested again.
+        """
+        self.smsc_client = smsc_client
+        self.cache_seconds = cache_seconds
+        self.connection = sqlite3.connect(db_path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS segment_costs (phone TEXT PRIMARY KEY, cost REAL, calibrated_at REAL)',
+            )
+        self._segment_costs: dict[str, float] = {}
+
+    async def segment_cost(self, phone: str, sample_text: str) -> Optional[float]:
+        """Get cost of one SMS segment to the phone, calibrating it when the cached cost is missing or stale.
+
+        Args:
+            phone: receiver phone number.
+            sample_text: text used for the calibration request.
+
+        Returns:
+            Cost of one segment or None when it is unknown.
+        """
+        if phone in self._segment_costs:
+            return self._segment_costs[phone]
+        row = self.connection.execute(
+            'SELECT cost FROM segment_costs WHERE phone = ? AND calibrated_at > ?',
+            (phone, time() - self.cache_seconds),
+        ).fetchone()
+        if row is None:
+            calibrated_cost = await self._calibrate(phone, sample_text)
+            if calibrated_cost is None:
+                return None
+            segment_cost = calibrated_cost
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO segment_costs (phone, cost, calibrated_at) VALUES (?, ?, ?)',
+                    (phone, segment_cost, time()),
+                )
+        else:
+            segment_cost = row[0]
+        self._segment_costs[phone] = segment_cost
+        return segment_cost
+
+    @staticmethod
+    def estimate(body: str, segment_cost: Optional[float]) -> SegmentEstimate:
+        """Estimate price of the text sent in translit mode.
+
+        Args:
+            body: segment text.
+            segment_cost: cost of one SMS segment, None when unknown.
+
+        Returns:
+            Number of billed SMS segments and their cost.
+        """
+        segments = count_segments(transliterate(body))
+        return SegmentEstimate(segments, segments * (segment_cost or 0))
+
+    def close(self) -> None:
+        """Close database connection."""
+        self.connection.close()
+
+    async def _calibrate(self, phone: str, sample_text: str) -> Optional[float]:
+        """Request cost of the sample text and derive the cost of one segment.
+
+        Args:
+            phone: receiver phone number.
+            sample_text: text used for the calibration request.
+
+        Returns:
+            Cost of one segment or None when SMSC did not answer.
+        """
+        try:
+            response = await self.smsc_client.get_sms_cost(phone, sample_text, translit=1)
+            cost, sms_count = float(response[0]), int(response[1])
+        except (SMSCError, IndexError, ValueError) as cost_error:
+            logger.warning(f'SMS cost calibration failed: {cost_error!r}')
+            return None
+        if sms_count <= 0:
+            logger.warning(f'SMS cost calibration failed with result: {response}')
+            return None
+        logger.info(f'Calibrated SMS segment cost: {cost / sms_count}')
+        return cost / sms_count
+
+
+class BudgetPlanner(object):
+    """Planner choosing the most valuable pending segments that fit the per-cycle budget."""
+
+    def __init__(self, cost_model: CostModel, max_segments: Optional[int], max_cost: Optional[float]) -> None:
+        """Initialize BudgetPlanner object.
+
+        Args:
+            cost_model: SMS cost model.
+            max_segments: maximum number of SMS segments sent per cycle, None for no limit.
+            max_cost: maximum money spent per cycle, None for no limit.
+        """
+        self.cost_model = cost_model
+        self.max_segments = max_segments
+        self.max_cost = max_cost
+
+    async def plan(self, outbox: Outbox, phone: str) -> BudgetPlan:
+        """Skip pending segments over the budget, replacing the skipped tail of every dialog with a short notice.
+
+        Segments of higher priority dialogs go first, segments of newer Telegram messages are preferred within the
+        same priority. Dialogs are truncated and noticed separately for every receiver. Room for the notice of every
+        truncated dialog is reserved before the segments are selected, so the selection is repeated until no more
+        dialogs get truncated.
+
+        Args:
+            outbox: outbox with pending segments.
+            phone: phone number the segment cost is calibrated for.
+
+        Returns:
+            Budget plan of the cycle.
+        """
+        budget_plan = BudgetPlan()
+        pending_segments = outbox.pending_segments()
+        if not pending_segments:
+            return budget_plan
+        segment_cost = await self.cost_model.segment_cost(phone, pending_segments[0].body)
+        max_cost = await self._max_cost(segment_cost)
+        pending_segments.sort(
+            key=lambda segment: (-segment.priority, -(segment.source_at or segment.created_at), segment.segment_id),
+        )
+        route_counts = Counter(_dialog_route(segment) for segment in pending_segments)
+        truncated_routes: set[DialogRoute] = set()
+        while True:
+            notices_reserve = BudgetPlan()
+            for dialog_id, dialog, receiver in truncated_routes:
+                notice = _skipped_notice(dialog, route_counts[(dialog_id, dialog, receiver)])
+                self._add(notices_reserve, self.cost_model.estimate(notice, segment_cost))
+            budget_plan = self._select(pending_segments, segment_cost, max_cost, notices_reserve)
+            skipped_routes = {_dialog_route(segment) for segment in budget_plan.skipped} - truncated_routes
+            if not skipped_routes:
+                break
+            truncated_routes |= skipped_routes
+        if not budget_plan.skipped:
+            return budget_plan
+        outbox.skip(segment.segment_id for segment in budget_plan.skipped)
+        skipped_dialogs = Counter(
+            (segment.dialog_id, segment.dialog, segment.priority, segment.receiver) for segment in budget_plan.skipped
+        )
+        for (dialog_id, dialog, priority, receiver), skipped_count in skipped_dialogs.items():
+            notice = _skipped_notice(dialog, skipped_count)
+            estimate = self.cost_model.estimate(notice, segment_cost)
+            if self._fits(budget_plan, estimate, max_cost):
+                outbox.enqueue(dialog, [notice], priority, receivers=(receiver,), dialog_id=dialog_id)
+                self._add(budget_plan, estimate)
+        logger.info(
+            f'Budget plan: {len(budget_plan.selected)} segments, {budget_plan.segments} sms, cost {budget_plan.cost}, '
+            f'{len(budget_plan.skipped)} segments skipped',
+        )
+        return budget_plan
+
+    def _select(
+        self,
+        pending_segments: list[PendingSegment],
+        segment_cost: Optional[float],
+        max_cost: Optional[float],
+        reserve: BudgetPlan,
+    ) -> BudgetPlan:
+        """Select segments in preference order, the rest of a dialog is skipped after its first segment over budget.
+
+        Args:
+            pending_segments: pending segments in preference order.
+            segment_cost: cost of one SMS segment, None when unknown.
+            max_cost: money limit of the cycle, None for no limit.
+            reserve: part of the budget kept for notices.
+
+        Returns:
+            Budget plan without the reserve.
+        """
+        budget_plan = BudgetPlan(segments=reserve.segments, cost=reserve.cost)
+        truncated_routes = set()
+        for segment in pending_segments:
+            estimate = self.cost_model.estimate(segment.body, segment_cost)
+            dialog_route = _dialog_route(segment)
+            if dialog_route not in truncated_routes and self._fits(budget_plan, estimate, max_cost):
+                budget_plan.selected.append(segment)
+                self._add(budget_plan, estimate)
+            else:
+                truncated_routes.add(dialog_route)
+                budget_plan.skipped.append(segment)
+        budget_plan.segments -= reserve.segments
+        budget_plan.cost -= reserve.cost
+        return budget_plan
+
+    @staticmethod
+    def _add(budget_plan: BudgetPlan, estimate: SegmentEstimate) -> None:
+        """Count the segment price in the plan.
+
+        Args:
+            budget_plan: budget plan built so far.
+            estimate: estimated price of the segment.
+        """
+        budget_plan.segments += estimate.segments
+        budget_plan.cost += estimate.cost
+
+    async def _max_cost(self, segment_cost: Optional[float]) -> Optional[float]:
+        """Get money limit of the cycle, bounded by the account balance.
+
+        Args:
+            segment_cost: cost of one SMS segment, None when unknown.
+
+        Returns:
+            Money limit or None when the cost is not limited or unknown.
+        """
+        if segment_cost is None:
+            return None
+        money_limits = [] if self.max_cost is None else [self.max_cost]
+        try:
+            balance = await self.cost_model.smsc_client.get_balance()
+            if balance is not None:
+                money_limits.append(float(balance))
+        except (SMSCError, ValueError) as balance_error:
+            logger.warning(f'Balance request failed: {balance_error!r}')
+        return min(money_limits) if money_limits else None
+
+    def _fits(self, budget_plan: BudgetPlan, estimate: SegmentEstimate, max_cost: Optional[float]) -> bool:
+        """Check whether the segment fits the rest of the budget.
+
+        Args:
+            budget_plan: budget plan built so far.
+            estimate: estimated price of the segment.
+            max_cost: money limit of the cycle, None for no limit.
+
+        Returns:
+            True if the segment can be sent in the cycle.
+        """
+        if self.max_segments is not None and budget_plan.segments + estimate.segments > self.max_segments:
+            return False
+        return max_cost is None or budget_plan.cost + estimate.cost <= max_cost
+
+
+def _dialog_route(segment: PendingSegment) -> DialogRoute:
+    """Get the dialog and receiver the segment is truncated and noticed for.
+
+    Args:
+        segment: pending outbox segment.
+
+    Returns:
+        Dialog id, dialog title and receiver.
+    """
+    return segment.dialog_id, segment.dialog, segment.receiver
+
+
+def _skipped_notice(dialog: str, skipped_count: int) -> str:
+    """Build notice replacing the skipped segments of the dialog.
+
+    Args:
+        dialog: dialog title.
+        skipped_count: number of skipped segments.
+
+    Returns:
+        Notice text.
+    """
+    return f'{dialog}: {skipped_count} more sms skipped over budget'
@@ -8,6 +8,9 @@ class YamlConfigKeys(str, Enum):
 
     tg_user_data = 'tg_user_data'
     smsc_api_data = 'smsc_api_data'
+    live_mode = 'live_mode'
+    sending = 'sending'
+    accounts = 'accounts'
 
 
 class TgUserDataKeys(str, Enum):
@@ -18,9 +21,84 @@ class TgUserDataKeys(str, Enum):
     phone_number = 'phone_number'
 
 
+class AccountKeys(str, Enum):
+    """Enum for config Telegram account settings, credentials use TgUserDataKeys."""
+
+    name = 'name'
+    routes = 'routes'
+
+
+class RouteKeys(str, Enum):
+    """Enum for config account route settings."""
+
+    receivers = 'receivers'
+    chats = 'chats'
+
+
 class SMSApiDataKeys(str, Enum):
     """Enum for config client SMSC Api credentials."""
 
     login = 'login'
     password = 'password'
     receiver_phone_number = 'receiver_phone_number'
+
+
+class LiveModeKeys(str, Enum):
+    """Enum for config live mode settings."""
+
+    chats = 'chats'
+    batch_window_seconds = 'batch_window_seconds'
+
+
+class SendingKeys(str, Enum):
+    """Enum for config sending settings."""
+
+    messages_per_minute = 'messages_per_minute'
+    burst = 'burst'
+    default_priority = 'default_priority'
+    dialog_priorities = 'dialog_priorities'
+    max_segments_per_cycle = 'max_segments_per_cycle'
+    max_cost_per_cycle = 'max_cost_per_cycle'
+
+
+class SendingMode(str, Enum):
+    """Enum for SMS sending modes."""
+
+    sequential = 'sequential'
+    batch = 'batch'
+    paced = 'paced'
+
+
+class SendingTransport(str, Enum):
+    """Enum for SMSC transports SMS are sent over."""
+
+    http = 'http'
+    smtp = 'smtp'
+
+
+class SegmentStatus(str, Enum):
+    """Enum for outbox segment statuses."""
+
+    pending = 'pending'
+    claimed = 'claimed'
+    unknown = 'unknown'
+    sent = 'sent'
+    delivered = 'delivered'
+    failed = 'failed'
+    skipped = 'skipped'
+
+
+class SMSEncoding(str, Enum):
+    """Enum for SMS text encodings."""
+
+    gsm7 = 'gsm7'
+    ucs2 = 'ucs2'
+
+
+class ConnectionHealth(str, Enum):
+    """Enum for Telegram connection health states."""
+
+    disconnected = 'disconnected'
+    connecting = 'connecting'
+    connected = 'connected'
+    reconnecting = 'reconnecting'
@@ -2,226 +2,787 @@
 
 import asyncio
 import logging
-import os
-from datetime import datetime
-from textwrap import wrap
-from time import sleep
-from typing import Any, Optional
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from time import monotonic, time
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional
 
-import yaml
 from telethon import TelegramClient
-from telethon.errors import SessionPasswordNeededError
-
-from core.choices import SMSApiDataKeys, TgUserDataKeys, YamlConfigKeys
+from telethon.errors import FloodWaitError, SessionPasswordNeededError
+from telethon.tl.custom import Dialog, Message
+
+from core.async_smsc import AsyncSMSC, is_account_error_code, is_transient_error_code
+from core.budget import BudgetPlanner, CostModel
+from core.choices import SegmentStatus, SendingMode, SendingTransport
+from core.compaction import build_pipeline
+from core.config import AccountData, get_config
+from core.connection import TelegramConnectionManager, get_connection_manager, stop_connection_managers
+from core.dedup import ContentDeduplicator, message_keys
+from core.delivery import (
+    DELIVERED_STATUSES, FAILED_STATUSES, NOT_FOUND_ERROR_CODE, NOT_FOUND_STATUS, DeliveryTracker,
+)
+from core.exceptions import (
+    SMSCAccountError, SMSCError, SMSCPermanentError, SMSCRequestSentError, SMSCTransientError,
+)
+from core.metrics import (
+    dialogs_scanned, end_to_end_seconds, harvest_seconds, log_event, messages_harvested, outbox_depth, outbox_failed,
+    segment_bytes_produced, segments_produced, sms_accepted, sms_rejected,
+)
+from core.outbox import Outbox, Segment
+from core.rate_limit import TokenBucket
+from core.segmenter import MessageSplitter
 from core.settings import (
-    CLIENT_SESSION_FILE_NAME, CLIENT_SYSTEM_VERSION, CONFIG_FILE_PATH, MESSAGE_DELIVERY_TIME, SMS_SYMBOLS_COUNT_LIMIT,
-    TG_MESSAGES_DIR,
+    CLIENT_SYSTEM_VERSION, DEDUP_BACK_REFERENCE, FLOOD_WAIT_MAX_RETRIES,
+    HARVEST_BUFFER_MESSAGES, HARVEST_CONCURRENCY, MESSAGE_DELIVERY_TIME, SMS_SENDING_MODE, SMS_SMTP_FALLBACK,
+    SMS_TRANSPORT, SMSC_BATCH_MAX_MESSAGES,
 )
+from core.smtp_transport import SMTPTransport
+from core.state import DialogIndex, WatermarkStore
 
 logger = logging.getLogger('core.classes')
 logging.basicConfig(level=logging.INFO)
 
 
-class BaseAdapter(object):
-    """Base adapter class."""
+class TelegramController(object):
+    """Controller class for interacting with Telegram messages."""
 
-    def write(self, content: Any) -> Any:
-        """Write data to destination.
+    def __init__(self, account: Optional[AccountData] = None) -> None:
+        """Initialize TelegramController object.
 
         Args:
-            content: data to be written.
+            account: Telegram account to harvest, the first configured account when not passed.
         """
-        pass
+        self.account = account or get_config().accounts[0]
+        user_auth_data = self.account.tg_user_data
+        self.api_id, self.api_hash = user_auth_data.api_id, user_auth_data.api_hash
+        self.phone_number = user_auth_data.phone_number
 
-    def read(self) -> Any:
-        """Read data from a data source."""
-        pass
+    async def _auth_client(self, client: TelegramClient) -> None:
+        """Authorize Telegram client.
 
+        Args:
+            client: TelegramClient instance.
+        """
+        if not await client.is_user_authorized():
+            await client.send_code_request(self.phone_number)
+            try:
+                logger.info('Needed code confirmation')
+                await client.sign_in(self.phone_number, input('Enter the code: '))
+            except SessionPasswordNeededError:
+                logger.info('Needed password confirmation')
+                await client.sign_in(password=input('Enter password: '))
+            finally:
+                logger.info('Successfully authenticated to telegram account')
 
-class FileAdapter(BaseAdapter):
-    """Adapter class for i/o file operations."""
+    @staticmethod
+    async def _iter_message_chunks(
+        client: TelegramClient, dialog: Dialog, min_id: int,
+    ) -> AsyncIterator[list[Message]]:
+        """Stream messages of the dialog newer than min_id in bounded chunks, resuming after flood waits.
 
-    def __init__(self, file_path: str) -> None:
-        """Initialize FileAdapter object.
+        Args:
+            client: TelegramClient instance.
+            dialog: dialog with new messages.
+            min_id: id of the last already harvested or read message.
+
+        Yields:
+            Lists of at most HARVEST_BUFFER_MESSAGES messages from the oldest to the newest.
+
+        Raises:
+            FloodWaitError: if flood waits are exhausted, messages after the last yielded chunk are left for the
+                next poll.
+        """
+        chunk: list[Message] = []
+        for attempt in range(FLOOD_WAIT_MAX_RETRIES + 1):
+            try:
+                async for message in client.iter_messages(dialog.entity, min_id=min_id, reverse=True):
+                    chunk.append(message)
+                    if len(chunk) >= HARVEST_BUFFER_MESSAGES:
+                        min_id = chunk[-1].id
+                        yield chunk
+                        chunk = []
+                break
+            except FloodWaitError as flood_error:
+                if attempt == FLOOD_WAIT_MAX_RETRIES:
+                    logger.error(f'Stopped {dialog.name} dialog harvesting after {attempt + 1} flood waits')
+                    raise
+                logger.warning(f'Flood wait {flood_error.seconds}s for {dialog.name} dialog')
+                if chunk:
+                    min_id = chunk[-1].id
+                    yield chunk
+                    chunk = []
+                await asyncio.sleep(flood_error.seconds)
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _deduplicated_texts(
+        dialog_id: int, title: str, messages: Iterable[Message], deduplicator: ContentDeduplicator,
+    ) -> Iterator[Optional[str]]:
+        """Yield texts of incoming messages replacing ones already seen in other dialogs.
+
+        Own outgoing messages are skipped, the watermark still moves past them with the rest of the chunk.
 
         Args:
-            file_path: path to file for write and read operations.
+            dialog_id: marked id of the dialog.
+            title: dialog title.
+            messages: dialog messages from the oldest to the newest.
+            deduplicator: cache of seen message keys.
+
+        Yields:
+            Message text, back-reference to the dialog the message was first seen in, or nothing for duplicates.
         """
-        self.file_path = file_path
+        for message in messages:
+            if message.out:
+                continue
+            origin = deduplicator.check(dialog_id, title, message_keys(dialog_id, message))
+            if origin is None:
+                yield message.text
+            elif DEDUP_BACK_REFERENCE and origin.is_other_dialog(dialog_id, title):
+                yield f'[dup: {origin.title}]'
 
-    def write(self, content: str) -> None:
-        """Write data to a file.
+    @staticmethod
+    async def _save_dialog_messages(
+        client: TelegramClient,
+        dialog: Dialog,
+        watermark_store: WatermarkStore,
+        outbox: Outbox,
+        deduplicator: ContentDeduplicator,
+        semaphore: asyncio.Semaphore,
+        account: Optional[AccountData] = None,
+    ) -> None:
+        """Save messages of one dialog newer than its watermark to the outbox, once per routed receiver.
 
         Args:
-            content: data to be written to the file.
+            client: TelegramClient instance.
+            dialog: dialog to be harvested.
+            watermark_store: store of the last harvested message id per dialog.
+            outbox: outbox receiving SMS segments.
+            deduplicator: cache of message keys seen in all dialogs.
+            semaphore: semaphore bounding the number of concurrently harvested dialogs.
+            account: account with the dialog routes, segments go to the configured receiver when not passed.
         """
-        try:
-            with open(self.file_path, 'w') as file_obj:
-                file_obj.write(content)
-        except FileNotFoundError as file_error:
-            error_message = f'FileNotFoundError. Create folders first. Error: {file_error}'
-        else:
-            return None
-        logger.error(error_message)
-        return None
+        watermark = watermark_store.get(dialog.id)
+        top_message_id = dialog.message.id if dialog.message else 0
+        if watermark is None and not dialog.unread_count:
+            watermark_store.set(dialog.id, top_message_id)
+            return
+        if watermark is not None and top_message_id <= watermark:
+            return
+        title = dialog.name
+        receivers = (None,) if account is None else account.dialog_receivers(dialog.id, title)
+        if not receivers:
+            return
+        priority = get_config().sending.dialog_priority(dialog.id, title)
+        compaction_pipeline = build_pipeline()
+        message_splitter = MessageSplitter()
+        last_message_id, segments_count, messages_count = None, 0, 0
+        source_at: Optional[float] = None
+        async with semaphore:
+            try:
+                async for messages in TelegramController._iter_message_chunks(
+                    client, dialog, dialog.dialog.read_inbox_max_id if watermark is None else watermark,
+                ):
+                    texts = TelegramController._deduplicated_texts(dialog.id, title, messages, deduplicator)
+                    segments_count += outbox.enqueue(
+                        title,
+                        TelegramController._counted_segments(message_splitter.feed(compaction_pipeline.run(texts))),
+                        priority,
+                        segments_count,
+                        source_at or messages[0].date.timestamp(),
+                        receivers,
+                        dialog.id,
+                    )
+                    source_at = messages[0].date.timestamp()
+                    last_message_id = messages[-1].id
+                    messages_count += len(messages)
+                    messages_harvested.inc(len(messages))
+            finally:
+                if last_message_id is not None:
+                    segments_count += outbox.enqueue(
+                        title,
+                        TelegramController._counted_segments(message_splitter.finish()),
+                        priority,
+                        segments_count,
+                        source_at,
+                        receivers,
+                        dialog.id,
+                    )
+                    watermark_store.set(dialog.id, last_message_id)
+            if last_message_id is not None and dialog.unread_count:
+                await client.send_read_acknowledge(dialog.entity, max_id=last_message_id)
+        if last_message_id is not None:
+            logger.info(f'Parsed {title} dialog, compaction savings: {compaction_pipeline.report()}')
+            log_event('dialog_harvested', dialog=title, messages=messages_count, segments=segments_count)
 
-    def read(self) -> Optional[str]:
-        """Read data from a file.
+    @staticmethod
+    def _counted_segments(bodies: Iterable[str]) -> Iterator[str]:
+        """Pass segment texts through, counting produced segments and bytes.
+
+        Args:
+            bodies: segment texts.
+
+        Yields:
+            The same segment texts.
+        """
+        for body in bodies:
+            segments_produced.inc()
+            segment_bytes_produced.inc(len(body.encode()))
+            yield body
+
+    @staticmethod
+    async def _iter_changed_dialogs(
+        client: TelegramClient, dialog_index: Optional[DialogIndex], full_scan: bool,
+    ) -> AsyncIterator[Dialog]:
+        """Iterate dialogs whose top message changed since the previous poll.
+
+        The dialog list is ordered by the last message after the pinned dialogs, so listing stops at the first
+        unchanged not pinned dialog and polling cost follows the activity instead of the number of dialogs.
+
+        Args:
+            client: TelegramClient instance.
+            dialog_index: index of the previous poll, all dialogs are listed when not passed.
+            full_scan: whether to list all dialogs, skipping only unchanged ones.
+
+        Yields:
+            Changed or not indexed dialogs.
+        """
+        async for dialog in client.iter_dialogs():
+            dialogs_scanned.inc()
+            if dialog_index is None or not dialog_index.is_unchanged(dialog):
+                yield dialog
+            elif not full_scan and not dialog.pinned:
+                break
+
+    @staticmethod
+    async def _save_unread_messages(
+        client: TelegramClient,
+        watermark_store: WatermarkStore,
+        outbox: Outbox,
+        deduplicator: ContentDeduplicator,
+        account: Optional[AccountData] = None,
+        dialog_index: Optional[DialogIndex] = None,
+    ) -> None:
+        """Save new Telegram messages to the outbox harvesting changed dialogs concurrently.
+
+        A failed dialog, including one stopped by exhausted flood waits, is logged without stopping the others and
+        is harvested again on the next poll.
+
+        Args:
+            client: TelegramClient instance.
+            watermark_store: store of the last harvested message id per dialog.
+            outbox: outbox receiving SMS segments.
+            deduplicator: cache of message keys seen in all dialogs.
+            account: account with the dialog routes, segments go to the configured receiver when not passed.
+            dialog_index: index of dialogs updated after harvesting, all dialogs are checked when not passed.
+        """
+        started_at = monotonic()
+        semaphore = asyncio.Semaphore(HARVEST_CONCURRENCY)
+        full_scan = dialog_index is None or dialog_index.needs_full_scan()
+        dialogs = [
+            dialog async for dialog in TelegramController._iter_changed_dialogs(client, dialog_index, full_scan)
+        ]
+        harvest_results = await asyncio.gather(
+            *(
+                TelegramController._save_dialog_messages(
+                    client, dialog, watermark_store, outbox, deduplicator, semaphore, account,
+                )
+                for dialog in dialogs
+            ),
+            return_exceptions=True,
+        )
+        failed_positions = []
+        for position, (dialog, harvest_result) in enumerate(zip(dialogs, harvest_results)):
+            if isinstance(harvest_result, BaseException):
+                logger.error(f'Harvesting of {dialog.name} dialog failed: {harvest_result!r}')
+                failed_positions.append(position)
+        if dialog_index is not None:
+            # dialogs listed before a failed one stay changed, so the next poll lists dialogs down to it again
+            dialog_index.update(dialogs[failed_positions[-1] + 1:] if failed_positions else dialogs, full_scan)
+        harvest_duration = monotonic() - started_at
+        harvest_seconds.observe(harvest_duration)
+        outbox_depth.set(outbox.pending_count())
+        logger.info(
+            f'Polled {len(dialogs)} changed dialogs{" in full scan" if full_scan else ""}, '
+            f'{len(failed_positions)} failed, {deduplicator.hits} duplicate messages skipped',
+        )
+        log_event(
+            'harvest_finished',
+            dialogs=len(dialogs),
+            failed_dialogs=len(failed_positions),
+            full_scan=full_scan,
+            duplicates=deduplicator.hits,
+            duration=harvest_duration,
+        )
+
+    def _create_client(self) -> TelegramClient:
+        """Create Telegram client for the account.
 
         Returns:
-            Reading file content.
+            TelegramClient instance.
         """
-        try:
-            with open(self.file_path, 'r') as file_obj:
-                file_content = file_obj.read()
-        except FileNotFoundError as file_error:
-            error_message = f'FileNotFoundError. File with specified path not exists. Error: {file_error}'
-        else:
-            return file_content
-        logger.error(error_message)
-        return None
+        return TelegramClient(
+            session=self.account.session_name,
+            api_id=self.api_id,
+            api_hash=self.api_hash,
+            system_version=CLIENT_SYSTEM_VERSION,
+        )
 
+    @property
+    def connection_manager(self) -> TelegramConnectionManager:
+        """Get manager of the Telegram connection shared by all controllers of the process.
 
-class YamlFileAdapter(BaseAdapter):
-    """Adapter class for i/o yaml file operations."""
+        Returns:
+            TelegramConnectionManager instance.
+        """
+        return get_connection_manager(self.account.session_name, self._create_client, self._auth_client)
 
-    def __init__(self, file_path: str) -> None:
-        """Initialize YamlFileAdapter object.
+    async def save_unread_messages(self) -> None:
+        """Borrow connected Telegram client and save unread messages."""
+        async with self.connection_manager.borrow() as client:
+            watermark_store = WatermarkStore(self.account.state_db_path)
+            outbox = Outbox()
+            deduplicator = ContentDeduplicator(self.account.state_db_path)
+            dialog_index = DialogIndex(self.account.state_db_path)
+            try:
+                await self._save_unread_messages(
+                    client, watermark_store, outbox, deduplicator, self.account, dialog_index,
+                )
+            finally:
+                watermark_store.close()
+                outbox.close()
+                deduplicator.close()
+                dialog_index.close()
+
+
+class SMSController(object):
+    """Controller class for interacting with SMSC API."""
+
+    def __init__(
+        self,
+        sending_mode: SendingMode = SMS_SENDING_MODE,
+        outbox: Optional[Outbox] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        transport: SendingTransport = SMS_TRANSPORT,
+        smtp_fallback: bool = SMS_SMTP_FALLBACK,
+        smsc_client: Optional[AsyncSMSC] = None,
+        cost_model: Optional[CostModel] = None,
+    ):
+        """Initialize SMSController object.
 
         Args:
-            file_path: path to yaml file for write and read operations.
+            sending_mode: whether to send segments one by one, packed into list mode requests or paced by delivery.
+            outbox: outbox to read segments from, the default outbox is opened when not passed.
+            rate_limiter: token bucket bounding the sending rate, built from the config when not passed.
+            transport: whether to send segments over SMSC HTTP API or SMTP gateway, sending mode applies to HTTP.
+            smtp_fallback: whether to send segments over SMTP gateway when HTTP API is unavailable.
+            smsc_client: SMSC API client, a client of the default mirrors is created when not passed.
+            cost_model: SMS cost model, the model cached in the state database is used when not passed.
         """
-        self.file_path = file_path
+        config = get_config()
+        self.receiver_phone = config.smsc_api_data.receiver_phone_number
+        self.smsc_client = smsc_client or AsyncSMSC()
+        self.sending_mode = sending_mode
+        self.delivery_tracker = DeliveryTracker(self.smsc_client)
+        self.outbox = outbox or Outbox()
+        self.rate_limiter = rate_limiter or TokenBucket.per_minute(
+            config.sending.messages_per_minute, config.sending.burst,
+        )
+        self.transport = transport
+        self.smtp_fallback = smtp_fallback
+        self.smtp_transport = SMTPTransport()
+        self.cost_model = cost_model or CostModel(self.smsc_client)
+        self.budget_planner = BudgetPlanner(
+            self.cost_model, config.sending.max_segments_per_cycle, config.sending.max_cost_per_cycle,
+        )
 
-    def write(self, content: bytes) -> None:
-        """Write data to a yaml file.
+    @staticmethod
+    def _send_error_code(send_result: list[str]) -> int:
+        """Get error code of SMSC send response.
 
         Args:
-            content: data to be written to the yaml file.
+            send_result: SMSC send response.
+
+        Returns:
+            0 if the message was accepted, SMSC error code or -1 for unrecognized response otherwise.
         """
+        if len(send_result) > 1 and send_result[1] and not send_result[1].startswith('-'):
+            return 0
         try:
-            with open(self.file_path, 'wb') as file_obj:
-                yaml.safe_dump(content, file_obj)
-        except FileNotFoundError as file_error:
-            error_message = f'FileNotFoundError. Create folders first. Error: {file_error}'
-        except yaml.YAMLError as yaml_error:
-            error_message = f'YAMLError. YAML parser encounters an error condition. Error: {yaml_error}'
+            return abs(int(send_result[1]))
+        except (IndexError, ValueError):
+            return -1
+
+    def _handle_send_error(self, segment: Segment, error_code: int, send_result: Any) -> None:
+        """Return segment to the outbox on transient error or mark it failed on permanent one.
+
+        Args:
+            segment: outbox segment that was not accepted.
+            error_code: SMSC error code, -1 for unrecognized response.
+            send_result: SMSC send response for the log.
+
+        Raises:
+            SMSCAccountError: if SMSC rejected the account, so no other segment can be sent either.
+        """
+        logger.error(f'Message failed with result: {send_result}')
+        sms_rejected.inc(1, SendingTransport.http.value)
+        if is_account_error_code(error_code):
+            raise SMSCAccountError(f'SMSC rejected the account with error {error_code}')
+        if error_code < 0 or is_transient_error_code(error_code):
+            self.outbox.release(segment.segment_id)
         else:
-            return None
-        logger.error(error_message)
-        return None
+            self.outbox.fail(segment.segment_id)
 
-    def read(self) -> Optional[dict]:
-        """Read data from a yaml file.
+    def _mark_sent(self, segment: Segment, provider_id: Optional[str], transport: SendingTransport) -> None:
+        """Mark segment as accepted by the provider and record its end-to-end latency.
+
+        Args:
+            segment: outbox segment accepted by the provider.
+            provider_id: message id assigned by the provider.
+            transport: transport the segment was sent over.
+        """
+        self.outbox.mark_sent(segment.segment_id, provider_id)
+        self._record_accepted(segment, transport)
+
+    def _receiver(self, segment: Segment) -> str:
+        """Get phone number the segment is bound for.
+
+        Args:
+            segment: outbox segment.
 
         Returns:
-            Reading yaml file content.
+            Receiver of the segment or the configured receiver for segments without one.
         """
-        try:
-            with open(self.file_path, 'r') as file_obj:
-                file_content = yaml.safe_load(file_obj)
-        except FileNotFoundError as file_error:
-            error_message = f'FileNotFoundError. File with specified path not exists. Error: {file_error}'
-        except yaml.YAMLError as yaml_error:
-            error_message = f'YAMLError. YAML parser encounters an error condition. Error: {yaml_error}'
-        else:
-            return file_content
-        logger.error(error_message)
-        return None
+        return segment.receiver or str(self.receiver_phone)
 
+    def _coalesce(self, segments: list[Segment]) -> list[list[Segment]]:
+        """Group copies of one segment bound for different receivers, so each group is sent in one request.
 
-class TelegramController(object):
-    """Controller class for interacting with Telegram messages."""
+        Args:
+            segments: claimed outbox segments.
 
-    def __init__(self) -> None:
-        """Initialize TelegramController object."""
-        config_settings = YamlFileAdapter(CONFIG_FILE_PATH).read()
-        user_auth_data = config_settings[YamlConfigKeys.tg_user_data]
-        self.api_id, self.api_hash = user_auth_data[TgUserDataKeys.api_id], user_auth_data[TgUserDataKeys.api_hash]
-        self.phone_number = user_auth_data[TgUserDataKeys.phone_number]
+        Returns:
+            Groups of segments with the same dialog, position and text in claim order.
+        """
+        groups: dict[tuple[Optional[int], str, int, str, int], list[Segment]] = {}
+        copy_counts: Counter[tuple[Optional[int], str, int, str, str]] = Counter()
+        for segment in segments:
+            copy_key = (segment.dialog_id, segment.dialog, segment.position, segment.body, self._receiver(segment))
+            groups.setdefault((*copy_key[:4], copy_counts[copy_key]), []).append(segment)
+            copy_counts[copy_key] += 1
+        return list(groups.values())
 
-    async def _auth_client(self, client: TelegramClient) -> None:
-        """Authorize Telegram client.
+    def _group_by_receiver(self, segments: list[Segment]) -> list[list[Segment]]:
+        """Group segments bound for the same receiver, so each group is sent in one request.
 
         Args:
-            client: TelegramClient instance.
+            segments: claimed outbox segments.
+
+        Returns:
+            Segments of every receiver in claim order.
         """
-        if not await client.is_user_authorized():
-            await client.send_code_request(self.phone_number)
+        groups: dict[str, list[Segment]] = {}
+        for segment in segments:
+            groups.setdefault(self._receiver(segment), []).append(segment)
+        return list(groups.values())
+
+    def _phones(self, segments: list[Segment]) -> str:
+        """Join receivers of coalesced segments.
+
+        Args:
+            segments: copies of one segment.
+
+        Returns:
+            Phone numbers separated by comma.
+        """
+        return ','.join(self._receiver(segment) for segment in segments)
+
+    @contextmanager
+    def _unknown_on_sent_error(self, segments: list[Segment]) -> Iterator[None]:
+        """Keep segments of a send request failed after it was written out of the queue until SMSC is asked for them.
+
+        Segments are sent under the outbox id of the first of them, so their status can be requested later.
+
+        Args:
+            segments: segments sent in the request.
+
+        Yields:
+            Nothing, the request is made inside the context.
+        """
+        try:
+            yield
+        except SMSCRequestSentError:
+            self.outbox.mark_unknown((segment.segment_id for segment in segments), str(segments[0].segment_id))
+            raise
+
+    async def _reconcile_unknown(self) -> None:
+        """Resolve segments of send requests that failed after they were written by their SMSC status.
+
+        Segments SMSC has are marked sent or delivered, segments it has not seen or failed to deliver are returned
+        to the queue, the others are checked again in the next cycle.
+        """
+        statuses: dict[tuple[str, str], list[str]] = {}
+        for segment in self.outbox.unknown_segments():
+            status_key = (str(segment.provider_id), self._receiver(segment))
+            if status_key not in statuses:
+                try:
+                    statuses[status_key] = await self.smsc_client.get_status(*status_key)
+                except SMSCError as smsc_error:
+                    logger.warning(f'Status check of unknown segments failed: {smsc_error!r}')
+                    return
+            response = statuses[status_key]
             try:
-                logger.info('Needed code confirmation')
-                await client.sign_in(self.phone_number, input('Enter the code: '))
-            except SessionPasswordNeededError:
-                logger.info('Needed password confirmation')
-                await client.sign_in(password=input('Enter password: '))
-            finally:
-                logger.info('Successfully authenticated to telegram account')
+                if len(response) > 1 and response[1].startswith('-'):
+                    status = NOT_FOUND_STATUS if abs(int(response[1])) == NOT_FOUND_ERROR_CODE else None
+                else:
+                    status = int(response[0])
+            except (IndexError, ValueError):
+                status = None
+            if status is None:
+                continue
+            logger.info(f'Segment {segment.segment_id} sent under {segment.provider_id} has SMSC status {status}')
+            if status == NOT_FOUND_STATUS or status in FAILED_STATUSES:
+                self.outbox.release(segment.segment_id, SegmentStatus.unknown)
+            elif status in DELIVERED_STATUSES:
+                self.outbox.mark_delivered(segment.segment_id, segment.provider_id)
+            else:
+                self.outbox.mark_sent(segment.segment_id, segment.provider_id)
 
     @staticmethod
-    async def _save_unread_messages(client: TelegramClient) -> None:
-        """Save unread Telegram messages to specified dir.
+    def _record_accepted(segment: Segment, transport: SendingTransport) -> None:
+        """Count accepted segment and observe time since its oldest Telegram message.
 
         Args:
-            client: TelegramClient instance.
+            segment: outbox segment accepted by the provider.
+            transport: transport the segment was sent over.
         """
-        async for dialog in client.iter_dialogs():
-            if not dialog.unread_count:
+        sms_accepted.inc(1, transport.value)
+        if segment.source_at is not None:
+            end_to_end_seconds.observe(time() - segment.source_at)
+
+    async def _send_sequential(self, segments: list[Segment]) -> int:
+        """Send segments of every receiver in one request waiting a fixed delivery time after each request.
+
+        Segments bound for the same receiver, also the ones harvested by different accounts, are coalesced into one
+        list mode request.
+
+        Args:
+            segments: claimed outbox segments.
+
+        Returns:
+            Number of segments accepted by SMSC.
+        """
+        sent_count = 0
+        for receiver_segments in self._group_by_receiver(segments):
+            sent_count += await self._send_batch(receiver_segments)
+            await asyncio.sleep(MESSAGE_DELIVERY_TIME)
+        return sent_count
+
+    async def _send_paced(self, segments: list[Segment]) -> int:
+        """Send segments one by one releasing the next one as soon as the previous is delivered.
+
+        Args:
+            segments: claimed outbox segments of one receiver.
+
+        Returns:
+            Number of segments accepted by SMSC.
+        """
+        sent_count = 0
+        for segment in segments:
+            await self.rate_limiter.acquire()
+            with self._unknown_on_sent_error([segment]):
+                send_result = await self.smsc_client.send_sms(
+                    self._receiver(segment), segment.body, translit=1, message_id=segment.segment_id,
+                )
+            error_code = self._send_error_code(send_result)
+            if error_code:
+                self._handle_send_error(segment, error_code, send_result)
                 continue
-            messages = await client.get_messages(dialog.entity, limit=dialog.unread_count)
-            title = getattr(dialog.entity, 'title', 'default')
-            result_messages = []
-            for message in reversed(messages):
-                result_messages.append(message.text)
-                await client.send_read_acknowledge(dialog.entity, max_id=message.id)
-            channel_content_path = os.path.join(TG_MESSAGES_DIR, f'{title}_{datetime.now().date()}')
-            channel_content = '\n'.join(result_messages)
-            FileAdapter(channel_content_path).write(channel_content)
-            logger.info(f'Parsed {title} dialog')
+            sent_count += 1
+            self._record_accepted(segment, SendingTransport.http)
+            delivery_report = await self.delivery_tracker.wait_delivered(send_result[0], self._receiver(segment))
+            logger.info(f'Message {delivery_report.message_id} finished with status {delivery_report.status} '
+                        f'in {delivery_report.latency:.1f}s')
+            if delivery_report.is_delivered:
+                self.outbox.mark_delivered(segment.segment_id, delivery_report.message_id)
+            elif delivery_report.status in FAILED_STATUSES:
+                self.outbox.release(segment.segment_id)
+            else:
+                self.outbox.mark_sent(segment.segment_id, delivery_report.message_id)
+        return sent_count
+
+    async def _send_batch(self, segments: list[Segment]) -> int:
+        """Send segments packed into one SMSC list mode request.
+
+        Pieces share the request message id, each segment keeps the id with its position among the pieces to its
+        receiver as provider id.
 
-    async def save_unread_messages(self) -> None:
-        """Connect to Telegram and save unread messages."""
-        async with TelegramClient(
-            session=CLIENT_SESSION_FILE_NAME,
-            api_id=self.api_id,
-            api_hash=self.api_hash,
-            system_version=CLIENT_SYSTEM_VERSION,
-        ) as client:
-            await client.connect()
-            await self._auth_client(client)
-            await self._save_unread_messages(client)
+        Args:
+            segments: claimed outbox segments.
 
+        Returns:
+            Number of segments accepted by SMSC.
+        """
+        await self.rate_limiter.acquire(len(segments))
+        with self._unknown_on_sent_error(segments):
+            send_results = await self.smsc_client.send_sms_list(
+                [(self._receiver(segment), segment.body) for segment in segments],
+                translit=1,
+                message_id=segments[0].segment_id,
+            )
+        sent_count = 0
+        for segment, send_result in zip(segments, send_results):
+            if send_result.error_code:
+                self._handle_send_error(segment, send_result.error_code, send_result)
+            else:
+                self._mark_sent(segment, send_result.piece_id, SendingTransport.http)
+                sent_count += 1
+        logger.info(f'Sent {sent_count} of {len(segments)} sms in one list mode request')
+        return sent_count
+
+    async def _send_smtp(self, segments: list[Segment]) -> int:
+        """Send segments one by one over the SMTP session, using outbox ids as SMSC message ids.
+
+        Copies of a segment bound for different receivers are sent in one mail under the id of the first copy.
 
-class SMSController(object):
-    """Controller class for interacting with SMSC API."""
+        Args:
+            segments: claimed outbox segments.
+
+        Returns:
+            Number of segments accepted by the SMTP server.
+        """
+        sent_count = 0
+        for group in self._coalesce(segments):
+            await self.rate_limiter.acquire(len(group))
+            try:
+                await self.smtp_transport.send_sms(
+                    self._phones(group), group[0].body, translit=1, message_id=group[0].segment_id,
+                )
+            except SMSCPermanentError as smtp_error:
+                logger.error(f'Message rejected by SMTP server: {smtp_error!r}')
+                sms_rejected.inc(len(group), SendingTransport.smtp.value)
+                for segment in group:
+                    self.outbox.fail(segment.segment_id)
+                continue
+            for segment in group:
+                self._mark_sent(segment, str(group[0].segment_id), SendingTransport.smtp)
+            sent_count += len(group)
+        logger.info(f'Sent {sent_count} of {len(segments)} sms over SMTP')
+        return sent_count
 
-    def __init__(self):
-        """Initialize SMSController object."""
-        from core.smsc_api import SMSC
-        config_settings = YamlFileAdapter(CONFIG_FILE_PATH).read()
-        self.receiver_phone = config_settings[YamlConfigKeys.smsc_api_data][SMSApiDataKeys.receiver_phone_number]
-        self.smsc_client = SMSC()
+    async def _send_fallback(self, segments: list[Segment], smsc_error: SMSCError) -> Optional[int]:
+        """Send segments left unsent by the failed HTTP API over SMTP gateway when the fallback is enabled.
 
-    def _send_message(self, message_text: str) -> None:
-        """Send message using the SMSC client.
+        Only transient errors fall back, segments of a request that failed after it was sent stay unknown until
+        their SMSC status is checked, since SMSC may have accepted them and resending them would duplicate the messages.
 
         Args:
-            message_text: The text message to be sent.
+            segments: claimed outbox segments.
+            smsc_error: error of the HTTP API.
+
+        Returns:
+            Number of segments sent over SMTP or None if sending has to be postponed.
+        """
+        can_fall_back = self.smtp_fallback and self.transport == SendingTransport.http
+        if can_fall_back and isinstance(smsc_error, SMSCTransientError):
+            logger.warning(f'SMSC HTTP API is unavailable, sending over SMTP: {smsc_error!r}')
+            try:
+                return await self._send_smtp(self.outbox.still_claimed(segments))
+            except SMSCAccountError as account_error:
+                logger.error(f'SMTP gateway rejected the account, sending postponed: {account_error!r}')
+                self.outbox.postpone(segment.segment_id for segment in segments)
+                return None
+            except SMSCError as smtp_error:
+                smsc_error = smtp_error
+        logger.error(f'SMSC is unavailable, sending postponed: {smsc_error!r}')
+        for segment in segments:
+            self.outbox.release(segment.segment_id)
+        return None
+
+    async def send_messages(self) -> None:
+        """Send pending outbox segments in priority order until the outbox is drained or SMSC stops accepting them.
+
+        Segments over the cycle budget are skipped before sending.
+        Batches are not larger than the rate limiter burst, so a batch never exceeds the provider limit.
+        Sequential mode claims batches too and coalesces the segments of every receiver into one request.
+        Paced mode sends to every receiver in a separate lane, lanes wait for deliveries concurrently.
+        Segments of earlier requests that failed after they were written are resolved by their SMSC status first.
         """
-        wrapped_messages = wrap(message_text, width=SMS_SYMBOLS_COUNT_LIMIT)
-        for message in wrapped_messages:
-            send_result = self.smsc_client.send_sms(str(self.receiver_phone).encode(), message.encode(), translit=1)
-            logger.info(f'Message sent with result: {send_result}')
-            sleep(MESSAGE_DELIVERY_TIME)
+        await self._reconcile_unknown()
+        await self.budget_planner.plan(self.outbox, str(self.receiver_phone))
+        send_segments = {
+            SendingMode.sequential: self._send_sequential,
+            SendingMode.paced: self._send_paced,
+            SendingMode.batch: self._send_batch,
+        }[self.sending_mode]
+        claim_size = max(1, min(SMSC_BATCH_MAX_MESSAGES, self.rate_limiter.capacity))
+        if self.transport == SendingTransport.smtp:
+            send_segments, claim_size = self._send_smtp, max(1, self.rate_limiter.capacity)
+        elif self.sending_mode == SendingMode.paced:
+            await asyncio.gather(*(
+                self._send_claimed(partial(self.outbox.claim, 1, (receiver,)), send_segments)
+                for receiver in self.outbox.pending_receivers()
+            ))
+            self._publish_outbox_state()
+            return
+        await self._send_claimed(partial(self.outbox.claim, claim_size), send_segments)
+        self._publish_outbox_state()
+
+    def _publish_outbox_state(self) -> None:
+        """Publish numbers of waiting and failed outbox segments."""
+        outbox_depth.set(self.outbox.pending_count())
+        outbox_failed.set(self.outbox.status_counts()[SegmentStatus.failed])
+
+    async def _send_claimed(
+        self, claim_segments: Callable[[], list[Segment]], send_segments: Callable[[list[Segment]], Awaitable[int]],
+    ) -> None:
+        """Claim and send segments until there are no more of them or SMSC stops accepting them.
+
+        Sending stops when none of the claimed segments is accepted and some of them are returned to the outbox
+        after transient errors, segments rejected for good do not stop the others.
+        Account errors return all claimed segments to the outbox without counting the attempt and stop sending.
 
-    def send_messages(self) -> None:
-        """Send SMS messages for each file in the TG_MESSAGES_DIR directory."""
-        for filename in os.listdir(TG_MESSAGES_DIR):
-            file_path = os.path.join(TG_MESSAGES_DIR, filename)
-            file_content = FileAdapter(file_path=file_path).read()
-            self._send_message(file_content)
-            logger.info(f'Sent sms for {filename}')
+        Args:
+            claim_segments: function claiming the next segments from the outbox.
+            send_segments: coroutine function sending claimed segments and returning the number of accepted ones.
+        """
+        while segments := claim_segments():
+            outbox_depth.set(self.outbox.pending_count())
+            started_at = monotonic()
+            try:
+                sent_count = await send_segments(segments)
+            except SMSCAccountError as account_error:
+                logger.error(f'SMSC account is unusable, sending postponed: {account_error!r}')
+                self.outbox.postpone(segment.segment_id for segment in segments)
+                break
+            except SMSCError as smsc_error:
+                fallback_count = await self._send_fallback(segments, smsc_error)
+                if fallback_count is None:
+                    break
+                sent_count = fallback_count
+            log_event(
+                'segments_sent', claimed=len(segments), sent=sent_count, duration=monotonic() - started_at,
+            )
+            if not sent_count and self.outbox.released(segments):
+                logger.error(f'SMSC accepted none of {len(segments)} segments, sending postponed')
+                break
+
+    async def close(self) -> None:
+        """Close pooled SMSC client connections, SMTP session, the outbox and the cost model."""
+        await self.smsc_client.close()
+        await self.smtp_transport.close()
+        self.outbox.close()
+        self.cost_model.close()
+
+
+async def main() -> None:
+    """Save unread messages once and disconnect."""
+    try:
+        await TelegramController().save_unread_messages()
+    finally:
+        await stop_connection_managers()
 
 
 if __name__ == '__main__':
-    telegram_controller = TelegramController()
-    asyncio.run(telegram_controller.save_unread_messages())
+    asyncio.run(main())
@@ -0,0 +1,363 @@
+"""Module with compaction of dialog messages before they are split to SMS."""
+
+import re
+from collections import OrderedDict
+from typing import Iterable, Iterator, NamedTuple, Optional, Sequence, TypeVar
+
+from core.segmenter import count_segments, transliterate
+from core.settings import (
+    COMPACTION_DEDUPE_MIN_LINE_LENGTH, COMPACTION_MAX_REMEMBERED_LINES, COMPACTION_SIGNATURE_MIN_LINE_LENGTH,
+    COMPACTION_STAGE_NAMES,
+)
+
+URL_PATTERN = re.compile(r'(?:https?://|www\.)([^\s/$.?#][^\s/?#)]*)[^\s)]*', re.IGNORECASE)
+MARKDOWN_LINK_PATTERN = re.compile(r'\[([^\]]*)\]\(([^)\s]+)\)')
+MARKDOWN_MARKUP_PATTERN = re.compile(r'\*\*|__|~~|```|`')
+EMOJI_PATTERN = re.compile('[\U0001F000-\U0010FFFF\u2600-\u27BF\u2B00-\u2BFF\uFE0E\uFE0F\u200D\u20E3]')
+SPACES_PATTERN = re.compile(r'[ \t\u00a0]+')
+BLANK_LINES_PATTERN = re.compile(r'\n{3,}')
+
+TextT = TypeVar('TextT', bound=Optional[str])
+
+
+class StageStats(NamedTuple):
+    """Sizes of the texts before and after a compaction stage."""
+
+    bytes_in: int
+    bytes_out: int
+
+
+class CompactionStage(object):
+    """Base compaction stage transforming messages of one dialog."""
+
+    name = 'base'
+
+    def process(self, text: str) -> Optional[str]:
+        """Compact message text.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Compacted text or None if the message should be dropped.
+        """
+        return text
+
+
+class DropMediaPlaceholders(CompactionStage):
+    """Stage dropping messages without text, like media-only posts."""
+
+    name = 'drop_media'
+
+    def process(self, text: Optional[str]) -> Optional[str]:
+        """Drop empty message.
+
+        Args:
+            text: message text, None for media-only messages.
+
+        Returns:
+            Text or None if it is empty.
+        """
+        return text if text and text.strip() else None
+
+
+class StripMarkdown(CompactionStage):
+    """Stage removing markdown markup, keeping link texts and urls."""
+
+    name = 'strip_markdown'
+
+    def process(self, text: str) -> Optional[str]:
+        """Remove markdown markup.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Plain text.
+        """
+        text = MARKDOWN_LINK_PATTERN.sub(
+            lambda match: match.group(1) if match.group(1) == match.group(2) else f'{match.group(1)} {match.group(2)}',
+            text,
+        )
+        return MARKDOWN_MARKUP_PATTERN.sub('', text)
+
+
+class ShortenLinks(CompactionStage):
+    """Stage replacing urls with their domain names."""
+
+    name = 'shorten_links'
+
+    def process(self, text: str) -> Optional[str]:
+        """Shorten urls.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Text with domain names instead of urls.
+        """
+        return URL_PATTERN.sub(lambda match: match.group(1).removeprefix('www.'), text)
+
+
+class StripEmoji(CompactionStage):
+    """Stage removing emoji which force UCS-2 encoding."""
+
+    name = 'strip_emoji'
+
+    def process(self, text: str) -> Optional[str]:
+        """Remove emoji.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Text without emoji.
+        """
+        return EMOJI_PATTERN.sub('', text)
+
+
+class NormalizeWhitespace(CompactionStage):
+    """Stage collapsing repeated spaces and blank lines."""
+
+    name = 'normalize_whitespace'
+
+    def process(self, text: str) -> Optional[str]:
+        """Normalize whitespace.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Text with single spaces, stripped lines and at most one blank line in a row.
+        """
+        lines = (SPACES_PATTERN.sub(' ', line).strip() for line in text.splitlines())
+        return BLANK_LINES_PATTERN.sub('\n\n', '\n'.join(lines)).strip() or None
+
+
+class RecentLines(object):
+    """Set of the most recently added lines of bounded size."""
+
+    def __init__(self, max_size: int = COMPACTION_MAX_REMEMBERED_LINES) -> None:
+        """Initialize RecentLines object.
+
+        Args:
+            max_size: maximum number of remembered lines.
+        """
+        self.max_size = max_size
+        self._lines: OrderedDict[str, None] = OrderedDict()
+
+    def __contains__(self, line: str) -> bool:
+        """Check whether the line is remembered.
+
+        Args:
+            line: text line.
+
+        Returns:
+            True if the line is one of the recently added lines.
+        """
+        return line in self._lines
+
+    def add(self, line: str) -> None:
+        """Remember the line, forgetting the oldest line when the set is full.
+
+        Args:
+            line: text line.
+        """
+        self._lines[line] = None
+        self._lines.move_to_end(line)
+        if len(self._lines) > self.max_size:
+            self._lines.popitem(last=False)
+
+
+class StripSignatures(CompactionStage):
+    """Stage removing trailing lines the dialog already ended another message with."""
+
+    name = 'strip_signatures'
+
+    def __init__(self) -> None:
+        """Initialize StripSignatures object."""
+        self._trailing_lines = RecentLines()
+
+    def process(self, text: str) -> Optional[str]:
+        """Remove repeated footer lines.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Text without footer lines seen at the end of previous messages, short lines and messages consisting
+            of footer lines only are kept.
+        """
+        lines = text.splitlines()
+        content_end = len(lines)
+        while content_end and (not lines[content_end - 1].strip() or self._is_signature(lines[content_end - 1])):
+            content_end -= 1
+        if not any(line.strip() for line in lines[:content_end]):
+            content_end = len(lines)
+        for line in lines[max(content_end - 1, 0):]:
+            if len(line.strip()) >= COMPACTION_SIGNATURE_MIN_LINE_LENGTH:
+                self._trailing_lines.add(line)
+        return '\n'.join(lines[:content_end]) or None
+
+    def _is_signature(self, line: str) -> bool:
+        """Check whether the line ended a previous message and is long enough to be a footer.
+
+        Args:
+            line: text line.
+
+        Returns:
+            True if the line can be stripped.
+        """
+        return len(line.strip()) >= COMPACTION_SIGNATURE_MIN_LINE_LENGTH and line in self._trailing_lines
+
+
+class DedupeLines(CompactionStage):
+    """Stage removing lines that already appeared in the dialog."""
+
+    name = 'dedupe_lines'
+
+    def __init__(self) -> None:
+        """Initialize DedupeLines object."""
+        self._seen_lines = RecentLines()
+
+    def process(self, text: str) -> Optional[str]:
+        """Remove repeated lines.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Text without lines seen before, short lines are always kept.
+        """
+        result_lines = []
+        for line in text.splitlines():
+            if len(line) >= COMPACTION_DEDUPE_MIN_LINE_LENGTH:
+                if line in self._seen_lines:
+                    continue
+                self._seen_lines.add(line)
+            result_lines.append(line)
+        return '\n'.join(result_lines) or None
+
+
+COMPACTION_STAGES: dict[str, type[CompactionStage]] = {
+    stage.name: stage for stage in (
+        DropMediaPlaceholders, StripMarkdown, ShortenLinks, StripEmoji, NormalizeWhitespace, StripSignatures,
+        DedupeLines,
+    )
+}
+
+
+class CompactionPipeline(object):
+    """Ordered chain of compaction stages run as a streaming generator over messages of one dialog."""
+
+    def __init__(self, stages: Sequence[CompactionStage]) -> None:
+        """Initialize CompactionPipeline object.
+
+        Args:
+            stages: compaction stages in application order.
+        """
+        self.stages = stages
+        self.stats = {stage.name: StageStats(0, 0) for stage in stages}
+        self.segments_in = 0
+        self.segments_out = 0
+
+    def run(self, texts: Iterable[Optional[str]]) -> Iterator[str]:
+        """Compact message texts lazily.
+
+        Segments are counted only at the pipeline input and output, stages count bytes since transliterating
+        every text after every stage would cost more than the compaction itself.
+
+        Args:
+            texts: message texts, None for messages without text.
+
+        Returns:
+            Iterator over compacted non-empty texts.
+        """
+        stream: Iterable[Optional[str]] = self._count_segments(texts, is_output=False)
+        for stage in self.stages:
+            stream = self._run_stage(stage, stream)
+        return self._count_segments((text for text in stream if text), is_output=True)
+
+    def report(self) -> str:
+        """Describe savings of every stage and of the whole pipeline.
+
+        Returns:
+            Human readable per-stage bytes savings and total bytes and segments savings.
+        """
+        stage_reports = [f'{name}: -{stats.bytes_in - stats.bytes_out}B' for name, stats in self.stats.items()]
+        stats = list(self.stats.values())
+        bytes_saved = stats[0].bytes_in - stats[-1].bytes_out if stats else 0
+        stage_reports.append(f'total: -{bytes_saved}B/-{self.segments_in - self.segments_out}sms')
+        return ', '.join(stage_reports)
+
+    def _count_segments(self, texts: Iterable[TextT], is_output: bool) -> Iterator[TextT]:
+        """Pass texts through, counting their SMS segments.
+
+        Args:
+            texts: pipeline input or output texts.
+            is_output: whether the texts are the pipeline output.
+
+        Yields:
+            The same texts.
+        """
+        for text in texts:
+            if is_output:
+                self.segments_out += _text_segments(text)
+            else:
+                self.segments_in += _text_segments(text)
+            yield text
+
+    def _run_stage(self, stage: CompactionStage, texts: Iterable[Optional[str]]) -> Iterator[Optional[str]]:
+        """Apply the stage to every text, collecting its bytes stats.
+
+        Args:
+            stage: compaction stage.
+            texts: input texts.
+
+        Yields:
+            Texts kept by the stage.
+        """
+        for text in texts:
+            compacted_text = stage.process(text) if text else None
+            stats = self.stats[stage.name]
+            self.stats[stage.name] = StageStats(
+                stats.bytes_in + _text_bytes(text), stats.bytes_out + _text_bytes(compacted_text),
+            )
+            if compacted_text:
+                yield compacted_text
+
+
+def _text_bytes(text: Optional[str]) -> int:
+    """Count UTF-8 bytes of the text.
+
+    Args:
+        text: text or None.
+
+    Returns:
+        Number of bytes.
+    """
+    return len(text.encode()) if text else 0
+
+
+def _text_segments(text: Optional[str]) -> int:
+    """Count SMS segments the transliterated text takes.
+
+    Args:
+        text: text or None.
+
+    Returns:
+        Number of segments.
+    """
+    return count_segments(transliterate(text)) if text else 0
+
+
+def build_pipeline(stage_names: Sequence[str] = COMPACTION_STAGE_NAMES) -> CompactionPipeline:
+    """Build compaction pipeline with fresh per-dialog state.
+
+    Args:
+        stage_names: names of the stages in application order.
+
+    Returns:
+        CompactionPipeline instance.
+    """
+    return CompactionPipeline([COMPACTION_STAGES[stage_name]() for stage_name in stage_names])
@@ -0,0 +1,343 @@
+"""Module with typed application config loaded once and reloaded when the file changes."""
+
+import os
+from dataclasses import dataclass
+from typing import Any, Optional, Union
+
+from core.adapters import YamlFileAdapter
+from core.choices import (
+    AccountKeys, LiveModeKeys, RouteKeys, SendingKeys, SMSApiDataKeys, TgUserDataKeys, YamlConfigKeys,
+)
+from core.exceptions import ConfigError
+from core.settings import (
+    CLIENT_SESSION_FILE_NAME, CONFIG_FILE_PATH, DEFAULT_ACCOUNT_NAME, LIVE_BATCH_WINDOW_SECONDS, SMS_CYCLE_MAX_COST,
+    SMS_CYCLE_MAX_SEGMENTS, SMS_DEFAULT_PRIORITY, SMS_RATE_BURST, SMS_RATE_PER_MINUTE, STATE_DB_PATH, STORAGE_DIR,
+)
+
+
+@dataclass(frozen=True)
+class TgUserData(object):
+    """Telegram account credentials."""
+
+    api_id: int
+    api_hash: str
+    phone_number: str
+
+
+@dataclass(frozen=True)
+class RouteData(object):
+    """Receivers of the account dialogs matching the chat filter."""
+
+    receivers: tuple[str, ...]
+    chats: tuple[Union[int, str], ...] = ()
+
+    def matches(self, dialog_id: int, title: str) -> bool:
+        """Check whether the dialog passes the chat filter.
+
+        Args:
+            dialog_id: marked dialog id.
+            title: dialog title.
+
+        Returns:
+            True if the filter is empty or lists the dialog id or title.
+        """
+        return not self.chats or dialog_id in self.chats or title in self.chats
+
+
+@dataclass(frozen=True)
+class AccountData(object):
+    """Telegram account with the routes of its dialogs to SMS receivers."""
+
+    name: str
+    tg_user_data: TgUserData
+    routes: tuple[RouteData, ...]
+
+    @property
+    def session_name(self) -> str:
+        """Get Telegram session file name of the account.
+
+        Returns:
+            Session name, the default account keeps the single account session.
+        """
+        if self.name == DEFAULT_ACCOUNT_NAME:
+            return CLIENT_SESSION_FILE_NAME
+        return f'{CLIENT_SESSION_FILE_NAME}_{self.name}'
+
+    @property
+    def state_db_path(self) -> str:
+        """Get path to harvesting state database of the account.
+
+        Returns:
+            Database path, the default account keeps the single account database.
+        """
+        if self.name == DEFAULT_ACCOUNT_NAME:
+            return STATE_DB_PATH
+        return os.path.join(STORAGE_DIR, f'state_{self.name}.sqlite3')
+
+    def dialog_receivers(self, dialog_id: int, title: str) -> tuple[str, ...]:
+        """Get receivers of the dialog messages.
+
+        Args:
+            dialog_id: marked dialog id.
+            title: dialog title.
+
+        Returns:
+            Phone numbers of all routes matching the dialog without repeats, empty if the dialog is not routed.
+        """
+        return tuple(dict.fromkeys(
+            receiver for route in self.routes if route.matches(dialog_id, title) for receiver in route.receivers
+        ))
+
+
+@dataclass(frozen=True)
+class SMSApiData(object):
+    """SMSC API credentials and receiver."""
+
+    login: str
+    password: str
+    receiver_phone_number: str
+
+
+@dataclass(frozen=True)
+class LiveModeData(object):
+    """Live mode settings."""
+
+    chats: tuple[Union[int, str], ...] = ()
+    batch_window_seconds: float = LIVE_BATCH_WINDOW_SECONDS
+
+
+@dataclass(frozen=True)
+class SendingData(object):
+    """SMS sending rate and dialog priorities."""
+
+    messages_per_minute: float = SMS_RATE_PER_MINUTE
+    burst: int = SMS_RATE_BURST
+    default_priority: int = SMS_DEFAULT_PRIORITY
+    dialog_priorities: tuple[tuple[str, int], ...] = ()
+    max_segments_per_cycle: Optional[int] = SMS_CYCLE_MAX_SEGMENTS
+    max_cost_per_cycle: Optional[float] = SMS_CYCLE_MAX_COST
+
+    def dialog_priority(self, dialog_id: Optional[int], title: str) -> int:
+        """Get priority class of the dialog listed by marked id or by title.
+
+        Args:
+            dialog_id: marked dialog id.
+            title: dialog title.
+
+        Returns:
+            Priority of the dialog, higher priority dialogs are sent first.
+        """
+        dialog_priorities = dict(self.dialog_priorities)
+        return dialog_priorities.get(str(dialog_id), dialog_priorities.get(title, self.default_priority))
+
+
+@dataclass(frozen=True)
+class Config(object):
+    """Application config."""
+
+    tg_user_data: TgUserData
+    smsc_api_data: SMSApiData
+    live_mode: LiveModeData
+    sending: SendingData
+    accounts: tuple[AccountData, ...]
+
+
+def _section(config_settings: dict, key: YamlConfigKeys, required: bool = True) -> dict:
+    """Get config section checking its type.
+
+    Args:
+        config_settings: parsed config file.
+        key: section key.
+        required: whether missing section is an error.
+
+    Returns:
+        Section content, empty for missing optional section.
+    """
+    section = config_settings.get(key.value)
+    if section is None and not required:
+        return {}
+    if not isinstance(section, dict):
+        raise ConfigError(f'Config section {key.value} must be a mapping')
+    return section
+
+
+def _value(section: dict, section_key: YamlConfigKeys, key: Any) -> Any:
+    """Get required config value.
+
+    Args:
+        section: config section content.
+        section_key: section key used in the error message.
+        key: value key.
+
+    Returns:
+        Config value.
+    """
+    if section.get(key.value) is None:
+        raise ConfigError(f'Config value {section_key.value}.{key.value} is required')
+    return section[key.value]
+
+
+def _optional_number(value: Any, number_type: type, default: Any) -> Any:
+    """Convert optional config number.
+
+    Args:
+        value: config value.
+        number_type: int or float.
+        default: value used when the config value is missing.
+
+    Returns:
+        Converted number or default.
+    """
+    return default if value is None else number_type(value)
+
+
+def _tg_user_data(section: dict, section_key: YamlConfigKeys) -> TgUserData:
+    """Convert Telegram account credentials.
+
+    Args:
+        section: config section with the credentials.
+        section_key: section key used in error messages.
+
+    Returns:
+        TgUserData instance.
+    """
+    try:
+        api_id = int(_value(section, section_key, TgUserDataKeys.api_id))
+    except ValueError as value_error:
+        raise ConfigError(f'Config value {section_key.value}.api_id must be an integer: {value_error}') from value_error
+    return TgUserData(
+        api_id=api_id,
+        api_hash=str(_value(section, section_key, TgUserDataKeys.api_hash)),
+        phone_number=str(_value(section, section_key, TgUserDataKeys.phone_number)),
+    )
+
+
+def _accounts(account_sections: Any, default_receiver: str) -> tuple[AccountData, ...]:
+    """Convert accounts list, routing all dialogs of an account without routes to the default receiver.
+
+    Args:
+        account_sections: parsed accounts list.
+        default_receiver: receiver phone number of the smsc_api_data section.
+
+    Returns:
+        Accounts in config order.
+    """
+    if not isinstance(account_sections, list) or not account_sections:
+        raise ConfigError('Config section accounts must be a non-empty list')
+    accounts = []
+    for account_section in account_sections:
+        if not isinstance(account_section, dict):
+            raise ConfigError('Config section accounts must contain mappings')
+        name = str(_value(account_section, YamlConfigKeys.accounts, AccountKeys.name))
+        try:
+            routes = tuple(
+                RouteData(
+                    receivers=tuple(str(receiver) for receiver in _value(
+                        route_section, YamlConfigKeys.accounts, RouteKeys.receivers,
+                    )),
+                    chats=tuple(route_section.get(RouteKeys.chats.value) or ()),
+                )
+                for route_section in account_section.get(AccountKeys.routes.value) or ()
+            )
+        except (AttributeError, TypeError) as value_error:
+            raise ConfigError(f'Config routes of account {name} are invalid: {value_error}') from value_error
+        accounts.append(AccountData(
+            name=name,
+            tg_user_data=_tg_user_data(account_section, YamlConfigKeys.accounts),
+            routes=routes or (RouteData(receivers=(default_receiver,)),),
+        ))
+    account_names = [account.name for account in accounts]
+    if len(set(account_names)) != len(account_names):
+        raise ConfigError(f'Config account names must be unique: {account_names}')
+    return tuple(accounts)
+
+
+def parse_config(config_settings: Optional[dict]) -> Config:
+    """Validate parsed config file and convert it to typed config.
+
+    Args:
+        config_settings: parsed config file.
+
+    Returns:
+        Config instance.
+    """
+    if not isinstance(config_settings, dict):
+        raise ConfigError('Config file is missing or is not a mapping')
+    smsc_section = _section(config_settings, YamlConfigKeys.smsc_api_data)
+    live_section = _section(config_settings, YamlConfigKeys.live_mode, required=False)
+    sending_section = _section(config_settings, YamlConfigKeys.sending, required=False)
+    smsc_api_data = SMSApiData(
+        login=str(_value(smsc_section, YamlConfigKeys.smsc_api_data, SMSApiDataKeys.login)),
+        password=str(_value(smsc_section, YamlConfigKeys.smsc_api_data, SMSApiDataKeys.password)),
+        receiver_phone_number=str(
+            _value(smsc_section, YamlConfigKeys.smsc_api_data, SMSApiDataKeys.receiver_phone_number),
+        ),
+    )
+    if config_settings.get(YamlConfigKeys.accounts.value) is None:
+        tg_user_data = _tg_user_data(
+            _section(config_settings, YamlConfigKeys.tg_user_data), YamlConfigKeys.tg_user_data,
+        )
+        accounts: tuple[AccountData, ...] = (AccountData(
+            name=DEFAULT_ACCOUNT_NAME,
+            tg_user_data=tg_user_data,
+            routes=(RouteData(receivers=(smsc_api_data.receiver_phone_number,)),),
+        ),)
+    else:
+        accounts = _accounts(config_settings[YamlConfigKeys.accounts.value], smsc_api_data.receiver_phone_number)
+        tg_user_data = accounts[0].tg_user_data
+    try:
+        sending = SendingData(
+            messages_per_minute=float(
+                sending_section.get(SendingKeys.messages_per_minute.value) or SMS_RATE_PER_MINUTE,
+            ),
+            burst=int(sending_section.get(SendingKeys.burst.value) or SMS_RATE_BURST),
+            default_priority=int(sending_section.get(SendingKeys.default_priority.value) or SMS_DEFAULT_PRIORITY),
+            dialog_priorities=tuple(
+                (str(title), int(priority))
+                for title, priority in (sending_section.get(SendingKeys.dialog_priorities.value) or {}).items()
+            ),
+            max_segments_per_cycle=_optional_number(
+                sending_section.get(SendingKeys.max_segments_per_cycle.value), int, SMS_CYCLE_MAX_SEGMENTS,
+            ),
+            max_cost_per_cycle=_optional_number(
+                sending_section.get(SendingKeys.max_cost_per_cycle.value), float, SMS_CYCLE_MAX_COST,
+            ),
+        )
+    except (AttributeError, TypeError, ValueError) as value_error:
+        raise ConfigError(f'Config section sending is invalid: {value_error}') from value_error
+    return Config(
+        tg_user_data=tg_user_data,
+        smsc_api_data=smsc_api_data,
+        live_mode=LiveModeData(
+            chats=tuple(live_section.get(LiveModeKeys.chats.value) or ()),
+            batch_window_seconds=float(
+                live_section.get(LiveModeKeys.batch_window_seconds.value) or LIVE_BATCH_WINDOW_SECONDS,
+            ),
+        ),
+        sending=sending,
+        accounts=accounts,
+    )
+
+
+_config_cache: dict[str, tuple[float, Config]] = {}
+
+
+def get_config(config_path: str = CONFIG_FILE_PATH) -> Config:
+    """Get config, parsing the file only when its modification time changed.
+
+    Args:
+        config_path: path to yaml config file.
+
+    Returns:
+        Config instance.
+    """
+    try:
+        modified_at = os.stat(config_path).st_mtime
+    except FileNotFoundError as file_error:
+        raise ConfigError(f'Config file {config_path} not exists') from file_error
+    cached_config = _config_cache.get(config_path)
+    if cached_config is not None and cached_config[0] == modified_at:
+        return cached_config[1]
+    config = parse_config(YamlFileAdapter(config_path).read())
+    _config_cache[config_path] = (modified_at, config)
+    return config
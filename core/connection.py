@@ -0,0 +1,192 @@
+"""Module with long-lived Telegram connection shared by all jobs of the process."""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from time import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from telethon import TelegramClient
+
+from core.choices import ConnectionHealth
+from core.exceptions import TelegramConnectionTimeoutError
+from core.metrics import log_event, tg_connected_since, tg_connection_up, tg_reconnects
+from core.settings import TG_BORROW_TIMEOUT, TG_RECONNECT_INITIAL_DELAY, TG_RECONNECT_MAX_DELAY
+
+logger = logging.getLogger('core.connection')
+
+
+class TelegramConnectionManager(object):
+    """Keeper of one connected Telegram client reconnecting it with backoff when the connection drops."""
+
+    def __init__(
+        self,
+        session_name: str,
+        client_factory: Callable[[], TelegramClient],
+        authorize: Callable[[TelegramClient], Awaitable[None]],
+    ) -> None:
+        """Initialize TelegramConnectionManager object.
+
+        Args:
+            session_name: Telegram session file name labeling the published health.
+            client_factory: function creating a not connected client.
+            authorize: coroutine function authorizing the connected client.
+        """
+        self.session_name = session_name
+        self.client_factory = client_factory
+        self.authorize = authorize
+        self.client: Optional[TelegramClient] = None
+        self.health = ConnectionHealth.disconnected
+        self.connected_since: Optional[float] = None
+        self.reconnect_count = 0
+        self.last_error: Optional[str] = None
+        self._connected = asyncio.Event()
+        self._supervisor: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        """Start connection supervisor unless it is already running.
+
+        Returns:
+            Supervisor task.
+        """
+        if self._supervisor is None or self._supervisor.done():
+            self._supervisor = asyncio.create_task(self._supervise())
+        return self._supervisor
+
+    async def stop(self) -> None:
+        """Stop reconnecting and disconnect the client."""
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+        if self.client is not None:
+            await self.client.disconnect()
+        self._connected.clear()
+        self.connected_since = None
+        self._set_health(ConnectionHealth.disconnected)
+
+    @asynccontextmanager
+    async def borrow(self, timeout: Optional[float] = TG_BORROW_TIMEOUT) -> AsyncIterator[TelegramClient]:
+        """Wait until the shared client is connected and authorized.
+
+        Args:
+            timeout: maximum time in seconds to wait for the connection, None to wait while reconnecting goes on.
+
+        Yields:
+            Connected TelegramClient instance.
+
+        Raises:
+            TelegramConnectionTimeoutError: if the client is not connected in time, reconnecting goes on.
+        """
+        supervisor = self.start()
+        connected_waiter = asyncio.create_task(self._connected.wait())
+        await asyncio.wait({connected_waiter, supervisor}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not connected_waiter.done():
+            connected_waiter.cancel()
+            if supervisor.done():
+                supervisor.result()
+            raise TelegramConnectionTimeoutError(
+                f'Telegram client of {self.session_name} session is not connected in {timeout}s: {self.last_error}',
+            )
+        yield self.client
+
+    async def wait_stopped(self) -> None:
+        """Wait until the supervisor stops, which happens only on stop or unrecoverable error."""
+        await self.start()
+
+    def health_state(self) -> dict:
+        """Describe connection health, the state is logged as tg_connection_health event on every change.
+
+        Returns:
+            Health state, connection uptime in seconds, number of reconnects and the last error.
+        """
+        return {
+            'health': self.health.value,
+            'uptime': time() - self.connected_since if self.connected_since else 0,
+            'reconnect_count': self.reconnect_count,
+            'last_error': self.last_error,
+        }
+
+    def _set_health(self, health: ConnectionHealth) -> None:
+        """Change connection health, publishing it as metrics and logging the change as JSON event.
+
+        Args:
+            health: new connection health.
+        """
+        tg_connection_up.set(int(health == ConnectionHealth.connected), self.session_name)
+        tg_connected_since.set(self.connected_since or 0, self.session_name)
+        if health != self.health:
+            self.health = health
+            log_event('tg_connection_health', session=self.session_name, **self.health_state())
+
+    async def _connect_with_backoff(self, client: TelegramClient) -> None:
+        """Connect and authorize the client, retrying network failures with exponential backoff.
+
+        Args:
+            client: shared client of the manager.
+        """
+        delay = TG_RECONNECT_INITIAL_DELAY
+        while True:
+            try:
+                await client.connect()
+                await self.authorize(client)
+            except (OSError, asyncio.TimeoutError) as connection_error:
+                self.last_error = repr(connection_error)
+                self._set_health(ConnectionHealth.reconnecting)
+                logger.warning(f'Telegram connection failed, retrying in {delay}s: {connection_error!r}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, TG_RECONNECT_MAX_DELAY)
+            else:
+                self.connected_since = time()
+                self._set_health(ConnectionHealth.connected)
+                self._connected.set()
+                logger.info('Telegram client connected')
+                return
+
+    async def _supervise(self) -> None:
+        """Keep the client connected for the life of the process."""
+        if self.client is None:
+            self.client = self.client_factory()
+        client = self.client
+        self._set_health(ConnectionHealth.connecting)
+        while True:
+            await self._connect_with_backoff(client)
+            await client.disconnected
+            self._connected.clear()
+            self.connected_since = None
+            self.reconnect_count += 1
+            tg_reconnects.inc(1, self.session_name)
+            self._set_health(ConnectionHealth.reconnecting)
+            logger.warning('Telegram connection dropped, reconnecting')
+
+
+_connection_managers: dict[str, TelegramConnectionManager] = {}
+
+
+def get_connection_manager(
+    session_name: str,
+    client_factory: Callable[[], TelegramClient],
+    authorize: Callable[[TelegramClient], Awaitable[None]],
+) -> TelegramConnectionManager:
+    """Get connection manager of the session, creating it on first use.
+
+    Args:
+        session_name: Telegram session file name.
+        client_factory: function creating a not connected client.
+        authorize: coroutine function authorizing the connected client.
+
+    Returns:
+        TelegramConnectionManager instance shared by the process.
+    """
+    if session_name not in _connection_managers:
+        _connection_managers[session_name] = TelegramConnectionManager(session_name, client_factory, authorize)
+    return _connection_managers[session_name]
+
+
+async def stop_connection_managers() -> None:
+    """Stop all connection managers of the process."""
+    for connection_manager in _connection_managers.values():
+        await connection_manager.stop()
@@ -0,0 +1,153 @@
+"""Module with cross-dialog deduplication of harvested messages."""
+
+import hashlib
+import re
+import sqlite3
+from collections import OrderedDict
+from time import time
+from typing import Iterable, NamedTuple, Optional
+
+from telethon.tl.custom import Message
+from telethon.utils import get_peer_id
+
+from core.settings import DEDUP_CACHE_SIZE, DEDUP_MIN_TEXT_LENGTH, STATE_DB_PATH
+
+NON_WORD_PATTERN = re.compile(r'\W+')
+
+
+def content_key(text: str) -> Optional[bytes]:
+    """Hash normalized message text.
+
+    Args:
+        text: message text.
+
+    Returns:
+        Hash of the text ignoring case, whitespace and punctuation, None for too short texts.
+    """
+    normalized_text = NON_WORD_PATTERN.sub(' ', text.lower()).strip()
+    if len(normalized_text) < DEDUP_MIN_TEXT_LENGTH:
+        return None
+    return hashlib.blake2b(normalized_text.encode(), digest_size=8).digest()
+
+
+def post_key(peer_id: int, message_id: int) -> bytes:
+    """Build key of the original post a message is or forwards.
+
+    Args:
+        peer_id: marked id of the chat the post was published in.
+        message_id: id of the post in that chat.
+
+    Returns:
+        Post key.
+    """
+    return f'post:{peer_id}:{message_id}'.encode()
+
+
+def message_keys(dialog_id: int, message: Message) -> list[Optional[bytes]]:
+    """Build dedup keys of the Telegram message.
+
+    Args:
+        dialog_id: marked id of the message dialog.
+        message: Telegram message.
+
+    Returns:
+        Content key, own post key and key of the forwarded post if any.
+    """
+    keys = [content_key(message.text) if message.text else None, post_key(dialog_id, message.id)]
+    forward_header = message.fwd_from
+    if forward_header and forward_header.from_id and forward_header.channel_post:
+        keys.append(post_key(get_peer_id(forward_header.from_id), forward_header.channel_post))
+    return keys
+
+
+class SeenOrigin(NamedTuple):
+    """Dialog a message was first seen in."""
+
+    dialog_id: Optional[int]
+    title: str
+
+    def is_other_dialog(self, dialog_id: int, title: str) -> bool:
+        """Check whether the message was first seen in another dialog.
+
+        Args:
+            dialog_id: marked id of the current dialog.
+            title: title of the current dialog.
+
+        Returns:
+            True if the origin is another dialog, origins saved without id are compared by title.
+        """
+        return self.title != title if self.dialog_id is None else self.dialog_id != dialog_id
+
+
+class ContentDeduplicator(object):
+    """LRU cache of seen message keys persisted between runs."""
+
+    def __init__(self, db_path: str = STATE_DB_PATH, max_size: int = DEDUP_CACHE_SIZE) -> None:
+        """Initialize ContentDeduplicator object, loading the most recently seen keys.
+
+        Args:
+            db_path: path to SQLite database file.
+            max_size: maximum number of remembered keys.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.connection = sqlite3.connect(db_path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS seen_content (key BLOB PRIMARY KEY, title TEXT, seen_at REAL, '
+                'dialog_id INTEGER)',
+            )
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(seen_content)')}
+            if 'dialog_id' not in columns:
+                self.connection.execute('ALTER TABLE seen_content ADD COLUMN dialog_id INTEGER')
+        rows = self.connection.execute(
+            'SELECT key, dialog_id, title FROM ('
+            'SELECT key, dialog_id, title, seen_at FROM seen_content ORDER BY seen_at DESC LIMIT ?) '
+            'ORDER BY seen_at',
+            (max_size,),
+        ).fetchall()
+        self._seen: OrderedDict[bytes, SeenOrigin] = OrderedDict(
+            (key, SeenOrigin(dialog_id, title)) for key, dialog_id, title in rows
+        )
+        self._touched_keys: set[bytes] = set()
+
+    def check(self, dialog_id: int, title: str, keys: Iterable[Optional[bytes]]) -> Optional[SeenOrigin]:
+        """Check whether a message with any of the keys was already seen and remember its keys.
+
+        Args:
+            dialog_id: marked id of the message dialog.
+            title: title of the message dialog.
+            keys: content and post keys of the message.
+
+        Returns:
+            Dialog the message was first seen in or None if the message is new.
+        """
+        present_keys = [key for key in keys if key]
+        origin = next((self._seen[key] for key in present_keys if key in self._seen), None)
+        for key in present_keys:
+            self._seen[key] = self._seen.get(key, origin or SeenOrigin(dialog_id, title))
+            self._seen.move_to_end(key)
+            self._touched_keys.add(key)
+        while len(self._seen) > self.max_size:
+            self._touched_keys.discard(self._seen.popitem(last=False)[0])
+        if origin is not None:
+            self.hits += 1
+        return origin
+
+    def close(self) -> None:
+        """Persist keys seen during the run, prune the oldest keys and close database connection."""
+        seen_at = time()
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO seen_content (key, dialog_id, title, seen_at) VALUES (?, ?, ?, ?)',
+                [
+                    (key, origin.dialog_id, origin.title, seen_at + index / 1e6)
+                    for index, (key, origin) in enumerate(self._seen.items()) if key in self._touched_keys
+                ],
+            )
+            self.connection.execute(
+                'DELETE FROM seen_content WHERE key NOT IN '
+                '(SELECT key FROM seen_content ORDER BY seen_at DESC LIMIT ?)',
+                (self.max_size,),
+            )
+        self.connection.close()
@@ -0,0 +1,143 @@
+"""Module with tracking of sent SMS delivery through SMSC status polling."""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import NamedTuple, Optional
+
+from core.async_smsc import AsyncSMSC
+from core.exceptions import SMSCError
+from core.settings import (
+    DELIVERY_POLL_BACKOFF_FACTOR, DELIVERY_POLL_INITIAL_DELAY, DELIVERY_POLL_MAX_DELAY, DELIVERY_TIMEOUT,
+)
+
+logger = logging.getLogger('core.delivery')
+
+DELIVERED_STATUSES = frozenset((1, 2, 4))
+FAILED_STATUSES = frozenset((3, 20, 22, 23, 24, 25))
+NOT_FOUND_STATUS = -3
+NOT_FOUND_ERROR_CODE = 3
+
+
+class DeliveryReport(NamedTuple):
+    """Final state of the tracked message."""
+
+    message_id: str
+    phone: str
+    status: Optional[int]
+    latency: float
+    is_delivered: bool
+
+
+@dataclass
+class InFlightMessage(object):
+    """Sent message waiting for the final delivery status."""
+
+    message_id: str
+    phone: str
+    future: asyncio.Future
+    sent_at: float = field(default_factory=monotonic)
+    next_check_at: float = 0
+    delay: float = DELIVERY_POLL_INITIAL_DELAY
+
+    def __post_init__(self) -> None:
+        """Schedule the first status check."""
+        self.next_check_at = self.sent_at + self.delay
+
+
+class DeliveryTracker(object):
+    """Poller of SMSC message statuses shared by all in-flight messages."""
+
+    def __init__(
+        self,
+        smsc_client: AsyncSMSC,
+        backoff_factor: float = DELIVERY_POLL_BACKOFF_FACTOR,
+        max_delay: float = DELIVERY_POLL_MAX_DELAY,
+        timeout: float = DELIVERY_TIMEOUT,
+    ) -> None:
+        """Initialize DeliveryTracker object.
+
+        Args:
+            smsc_client: SMSC client used for status requests.
+            backoff_factor: multiplier of the delay between status checks of one message.
+            max_delay: maximum delay in seconds between status checks of one message.
+            timeout: time in seconds after which the message is reported as not delivered.
+        """
+        self.smsc_client = smsc_client
+        self.backoff_factor = backoff_factor
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._in_flight: list[InFlightMessage] = []
+        self._wakeup = asyncio.Event()
+        self._poller: Optional[asyncio.Task] = None
+
+    def track(self, message_id: str, phone: str) -> asyncio.Future:
+        """Start tracking of the sent message.
+
+        Args:
+            message_id: SMSC message identifier.
+            phone: receiver phone number.
+
+        Returns:
+            Future resolved with DeliveryReport when the message reaches a final status.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight.append(InFlightMessage(message_id=message_id, phone=phone, future=future))
+        self._wakeup.set()
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        return future
+
+    async def wait_delivered(self, message_id: str, phone: str) -> DeliveryReport:
+        """Track the sent message and wait for its final status.
+
+        Args:
+            message_id: SMSC message identifier.
+            phone: receiver phone number.
+
+        Returns:
+            Delivery report of the message.
+        """
+        return await self.track(message_id, phone)
+
+    async def _poll(self) -> None:
+        """Check statuses of due in-flight messages concurrently until nothing is left to track."""
+        while self._in_flight:
+            now = monotonic()
+            due_messages = [message for message in self._in_flight if message.next_check_at <= now]
+            if not due_messages:
+                self._wakeup.clear()
+                next_check_at = min(message.next_check_at for message in self._in_flight)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=next_check_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await asyncio.gather(*(self._check(message) for message in due_messages))
+
+    async def _check(self, message: InFlightMessage) -> None:
+        """Request message status and resolve or reschedule the message.
+
+        Args:
+            message: in-flight message to be checked.
+        """
+        try:
+            response = await self.smsc_client.get_status(message.message_id, message.phone)
+        except SMSCError as smsc_error:
+            logger.warning(f'Status check of {message.message_id} failed: {smsc_error!r}')
+            response = []
+        try:
+            status: Optional[int] = int(response[0]) if response[1] and not response[1].startswith('-') else None
+        except (IndexError, ValueError):
+            status = None
+        now = monotonic()
+        is_delivered = status in DELIVERED_STATUSES
+        if is_delivered or status in FAILED_STATUSES or now - message.sent_at >= self.timeout:
+            self._in_flight.remove(message)
+            report = DeliveryReport(message.message_id, message.phone, status, now - message.sent_at, is_delivered)
+            if not message.future.done():
+                message.future.set_result(report)
+            return
+        message.delay = min(message.delay * self.backoff_factor, self.max_delay)
+        message.next_check_at = now + message.delay
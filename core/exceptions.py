@@ -0,0 +1,37 @@
+"""Module with project exceptions."""
+
+
+class ConfigError(Exception):
+    """Raised when config file is missing or invalid."""
+
+
+class HTTPConnectError(ConnectionError):
+    """Raised when connection to HTTP host cannot be opened, so the request was not sent."""
+
+
+class TelegramConnectionTimeoutError(TimeoutError):
+    """Raised when Telegram client is not connected in time while reconnecting goes on."""
+
+
+class SMSCError(Exception):
+    """Base error of SMSC API requests."""
+
+
+class SMSCTransientError(SMSCError):
+    """Raised on SMSC failures worth retrying later, like network errors or an overloaded API."""
+
+
+class SMSCTimeoutError(SMSCTransientError):
+    """Raised when SMSC mirror does not answer in time."""
+
+
+class SMSCPermanentError(SMSCError):
+    """Raised on SMSC failures retrying will not fix, like rejected credentials or parameters."""
+
+
+class SMSCRequestSentError(SMSCError):
+    """Raised when message sending request failed after it was written, so SMSC may have sent the messages."""
+
+
+class SMSCAccountError(SMSCError):
+    """Raised when SMSC rejects the whole account, like wrong credentials, no funds or a blocked IP."""
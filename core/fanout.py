@@ -0,0 +1,95 @@
+"""Module with Telegram accounts harvested in parallel by a pool of worker processes."""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence
+
+from core.classes import TelegramController
+from core.config import AccountData, get_config
+from core.connection import stop_connection_managers
+from core.settings import FANOUT_MAX_WORKERS
+
+logger = logging.getLogger('core.fanout')
+
+
+def shard_accounts(accounts: Sequence[AccountData], shards_count: int) -> list[tuple[str, ...]]:
+    """Split accounts into shards of nearly equal size.
+
+    Args:
+        accounts: configured accounts.
+        shards_count: maximum number of shards.
+
+    Returns:
+        Account names of every non-empty shard.
+    """
+    account_names = [account.name for account in accounts]
+    return [tuple(account_names[index::shards_count]) for index in range(min(shards_count, len(account_names)))]
+
+
+async def _poll_accounts(account_names: Sequence[str]) -> None:
+    """Poll accounts of one shard concurrently, each over its own session.
+
+    Args:
+        account_names: names of the shard accounts.
+    """
+    accounts = {account.name: account for account in get_config().accounts}
+    try:
+        poll_results = await asyncio.gather(
+            *(TelegramController(accounts[name]).save_unread_messages() for name in account_names),
+            return_exceptions=True,
+        )
+    finally:
+        await stop_connection_managers()
+    for name, poll_result in zip(account_names, poll_results):
+        if isinstance(poll_result, Exception):
+            logger.error(f'Polling of {name} account failed: {poll_result!r}')
+
+
+def _poll_shard(account_names: Sequence[str]) -> None:
+    """Poll accounts of one shard on the event loop of the worker process.
+
+    Args:
+        account_names: names of the shard accounts.
+    """
+    asyncio.run(_poll_accounts(account_names))
+
+
+async def poll_all_accounts(max_workers: int = FANOUT_MAX_WORKERS) -> None:
+    """Poll all configured accounts into the shared outbox.
+
+    A single account is polled in the current process keeping its long-lived connection, several accounts are
+    sharded across worker processes so slow accounts do not block the others.
+
+    Args:
+        max_workers: maximum number of worker processes.
+    """
+    accounts = get_config().accounts
+    if len(accounts) == 1:
+        await TelegramController(accounts[0]).save_unread_messages()
+        return
+    shards = shard_accounts(accounts, max_workers)
+    event_loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn')) as pool:
+        shard_results = await asyncio.gather(
+            *(event_loop.run_in_executor(pool, _poll_shard, shard) for shard in shards), return_exceptions=True,
+        )
+    for shard, shard_result in zip(shards, shard_results):
+        if isinstance(shard_result, Exception):
+            logger.error(f'Worker polling {", ".join(shard)} accounts failed: {shard_result!r}')
+    logger.info(f'Polled {len(accounts)} accounts in {len(shards)} worker processes')
+
+
+async def login_accounts() -> None:
+    """Authorize every configured account interactively, worker processes cannot ask for login codes."""
+    try:
+        for account in get_config().accounts:
+            async with TelegramController(account).connection_manager.borrow(timeout=None):
+                logger.info(f'Account {account.name} is authorized')
+    finally:
+        await stop_connection_managers()
+
+
+if __name__ == '__main__':
+    asyncio.run(login_accounts())
@@ -0,0 +1,155 @@
+"""Module with real-time forwarding of new Telegram messages via SMS."""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Optional, Sequence
+
+from telethon import events
+from telethon.utils import get_display_name
+
+from core.classes import SMSController, TelegramController
+from core.compaction import build_pipeline
+from core.config import get_config
+from core.connection import stop_connection_managers
+from core.metrics import start_metrics_server
+from core.segmenter import split_to_messages
+from core.settings import LIVE_METRICS_PORT
+from core.state import DialogIndex, WatermarkStore
+
+logger = logging.getLogger('core.live')
+
+
+DialogBatch = tuple[int, str, str, tuple[str, ...]]
+
+
+class MicroBatcher(object):
+    """Collector of new messages flushing them per dialog once the batch window elapses."""
+
+    def __init__(self, flush_callback: Callable[[list[DialogBatch]], Awaitable[None]], window: float) -> None:
+        """Initialize MicroBatcher object.
+
+        Args:
+            flush_callback: coroutine function receiving dialog id, title, text and receivers of every dialog batch.
+            window: time in seconds since the first message of the batch before it is flushed.
+        """
+        self.flush_callback = flush_callback
+        self.window = window
+        self._dialog_messages: dict[tuple[int, str, tuple[str, ...]], list[str]] = defaultdict(list)
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def add(self, dialog_id: int, title: str, text: str, receivers: Sequence[str]) -> None:
+        """Add message to the current batch.
+
+        Args:
+            dialog_id: marked id of the message dialog.
+            title: title of the message dialog.
+            text: message text.
+            receivers: phone numbers the dialog is routed to.
+        """
+        self._dialog_messages[(dialog_id, title, tuple(receivers))].append(text)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        """Send collected messages grouped by dialog."""
+        async with self._flush_lock:
+            dialog_messages, self._dialog_messages = self._dialog_messages, defaultdict(list)
+            if not dialog_messages:
+                return
+            dialog_texts = [
+                (dialog_id, title, f'{title}:\n' + '\n'.join(build_pipeline().run(messages)), receivers)
+                for (dialog_id, title, receivers), messages in dialog_messages.items()
+            ]
+            messages_count = sum(map(len, dialog_messages.values()))
+            logger.info(f'Flushing {messages_count} messages from {len(dialog_texts)} dialogs')
+            await self.flush_callback(dialog_texts)
+
+    async def _flush_later(self) -> None:
+        """Flush the batch after the batch window, again while messages arrived during the previous flush."""
+        while True:
+            await asyncio.sleep(self.window)
+            await self.flush()
+            if not self._dialog_messages:
+                return
+
+
+class LiveTelegramController(TelegramController):
+    """Controller forwarding new Telegram messages as soon as they arrive."""
+
+    def __init__(self) -> None:
+        """Initialize LiveTelegramController object."""
+        super().__init__()
+        live_settings = get_config().live_mode
+        self.chats = list(live_settings.chats) or None
+        self.batch_window = live_settings.batch_window_seconds
+
+    async def forward_new_messages(self, sms_controller: SMSController) -> None:
+        """Subscribe to new messages on one persistent connection and send them in micro-batches.
+
+        Args:
+            sms_controller: controller used to send flushed batches.
+        """
+        watermark_store = WatermarkStore(self.account.state_db_path)
+        dialog_index = DialogIndex(self.account.state_db_path)
+        pending_watermarks: dict[int, int] = {}
+
+        async def send_batch(dialog_texts: list[DialogBatch]) -> None:
+            batch_watermarks = dict(pending_watermarks)
+            pending_watermarks.clear()
+            sending_settings = get_config().sending
+            for dialog_id, title, text, receivers in dialog_texts:
+                sms_controller.outbox.enqueue(
+                    title,
+                    split_to_messages(text),
+                    sending_settings.dialog_priority(dialog_id, title),
+                    receivers=receivers,
+                    dialog_id=dialog_id,
+                )
+            await sms_controller.send_messages()
+            for dialog_id, message_id in batch_watermarks.items():
+                watermark_store.set(dialog_id, message_id)
+
+        batcher = MicroBatcher(send_batch, self.batch_window)
+
+        async def handle_new_message(event: events.NewMessage.Event) -> None:
+            if not event.message.text:
+                return
+            title = dialog_index.title(event.chat_id)
+            if title is None:
+                title = get_display_name(await event.get_chat())
+            receivers = self.account.dialog_receivers(event.chat_id, title)
+            if not receivers:
+                return
+            batcher.add(event.chat_id, title, event.message.text, receivers)
+            pending_watermarks[event.chat_id] = max(pending_watermarks.get(event.chat_id, 0), event.message.id)
+
+        async with self.connection_manager.borrow(timeout=None) as client:
+            event_builder = events.NewMessage(chats=self.chats, incoming=True)
+            client.add_event_handler(handle_new_message, event_builder)
+            logger.info(f'Listening for new messages with {self.batch_window}s batch window')
+            try:
+                await self.connection_manager.wait_stopped()
+            finally:
+                client.remove_event_handler(handle_new_message, event_builder)
+                await batcher.flush()
+                watermark_store.close()
+                dialog_index.close()
+
+
+async def main() -> None:
+    """Run live forwarding until interrupted."""
+    metrics_server = await start_metrics_server(port=LIVE_METRICS_PORT)
+    sms_controller = SMSController()
+    try:
+        await LiveTelegramController().forward_new_messages(sms_controller)
+    finally:
+        await sms_controller.close()
+        await stop_connection_managers()
+        if metrics_server is not None:
+            metrics_server.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
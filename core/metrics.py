@@ -0,0 +1,272 @@
+"""Module with process metrics exposed in Prometheus text format and logged as JSON events."""
+
+import asyncio
+import json
+import logging
+from bisect import bisect_left
+from time import time
+from typing import Optional, Sequence
+
+from core.settings import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger('core.metrics')
+
+LabelValues = tuple[str, ...]
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DELIVERY_LATENCY_BUCKETS = (60, 300, 900, 3600, 6 * 3600, 24 * 3600, 3 * 24 * 3600, 7 * 24 * 3600)
+
+
+class Metric(object):
+    """Base metric with values per label values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        """Initialize Metric object and register it.
+
+        Args:
+            name: metric name.
+            documentation: metric help text.
+            label_names: names of the metric labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        registry.append(self)
+
+    def render(self) -> list[str]:
+        """Render metric samples.
+
+        Returns:
+            Lines of Prometheus text format.
+        """
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def _labels(self, label_values: LabelValues, extra_labels: str = '') -> str:
+        """Format labels of a sample.
+
+        Args:
+            label_values: values of the metric labels.
+            extra_labels: formatted additional labels.
+
+        Returns:
+            Labels in braces or empty string.
+        """
+        labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values)]
+        if extra_labels:
+            labels.append(extra_labels)
+        return f'{{{",".join(labels)}}}' if labels else ''
+
+
+class Counter(Metric):
+    """Monotonically increasing metric."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        """Initialize Counter object.
+
+        Args:
+            name: metric name.
+            documentation: metric help text.
+            label_names: names of the metric labels.
+        """
+        super().__init__(name, documentation, label_names)
+        self.values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, *label_values: str) -> None:
+        """Increase the counter.
+
+        Args:
+            amount: increment.
+            label_values: values of the metric labels.
+        """
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        """Render counter samples.
+
+        Returns:
+            Lines of Prometheus text format.
+        """
+        samples = [f'{self.name}{self._labels(labels)} {value}' for labels, value in self.values.items()]
+        return super().render() + samples
+
+
+class Gauge(Counter):
+    """Metric that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value: float, *label_values: str) -> None:
+        """Set the gauge value.
+
+        Args:
+            value: new value.
+            label_values: values of the metric labels.
+        """
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    """Metric counting observations in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        """Initialize Histogram object.
+
+        Args:
+            name: metric name.
+            documentation: metric help text.
+            label_names: names of the metric labels.
+            buckets: upper bounds of the buckets in increasing order.
+        """
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+        self.bucket_counts: dict[LabelValues, list[int]] = {}
+        self.sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """Record an observation.
+
+        Args:
+            value: observed value.
+            label_values: values of the metric labels.
+        """
+        bucket_counts = self.bucket_counts.setdefault(label_values, [0] * (len(self.buckets) + 1))
+        bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] = self.sums.get(label_values, 0) + value
+
+    def render(self) -> list[str]:
+        """Render histogram samples.
+
+        Returns:
+            Lines of Prometheus text format.
+        """
+        samples = []
+        for labels, bucket_counts in self.bucket_counts.items():
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip((*self.buckets, '+Inf'), bucket_counts):
+                cumulative_count += bucket_count
+                bucket_labels = self._labels(labels, f'le="{upper_bound}"')
+                samples.append(f'{self.name}_bucket{bucket_labels} {cumulative_count}')
+            samples.append(f'{self.name}_sum{self._labels(labels)} {self.sums[labels]}')
+            samples.append(f'{self.name}_count{self._labels(labels)} {cumulative_count}')
+        return super().render() + samples
+
+
+registry: list[Metric] = []
+
+tg_connection_up = Gauge('tg_connection_up', 'Whether the Telegram session is connected.', ('session',))
+tg_connected_since = Gauge(
+    'tg_connection_connected_since_seconds', 'Unix time the Telegram session connected, 0 when disconnected.',
+    ('session',),
+)
+tg_reconnects = Counter('tg_reconnects_total', 'Dropped Telegram connections reconnected.', ('session',))
+dialogs_scanned = Counter('tg_dialogs_scanned_total', 'Telegram dialogs checked for new messages.')
+messages_harvested = Counter('tg_messages_harvested_total', 'Telegram messages read from dialogs.')
+harvest_seconds = Histogram(
+    'tg_harvest_seconds', 'Duration of harvesting all dialogs.', buckets=(1, 5, 15, 60, 300, 900),
+)
+segments_produced = Counter('outbox_segments_produced_total', 'SMS segments added to the outbox.')
+segment_bytes_produced = Counter(
+    'outbox_segment_bytes_produced_total', 'UTF-8 bytes of SMS segments added to the outbox.',
+)
+outbox_depth = Gauge('outbox_queue_depth', 'Outbox segments waiting to be sent.')
+outbox_failed = Gauge('outbox_failed', 'Outbox segments that failed for good and are kept until purged.')
+sms_accepted = Counter('sms_accepted_total', 'SMS segments accepted by the provider.', ('transport',))
+sms_rejected = Counter('sms_rejected_total', 'SMS segments not accepted by the provider.', ('transport',))
+end_to_end_seconds = Histogram(
+    'sms_end_to_end_seconds', 'Time from Telegram message to SMS accepted by the provider.',
+    buckets=DELIVERY_LATENCY_BUCKETS,
+)
+smsc_request_seconds = Histogram('smsc_request_seconds', 'SMSC API request latency.', ('host', 'cmd'))
+smsc_request_errors = Counter('smsc_request_errors_total', 'Failed SMSC API requests.', ('host', 'cmd'))
+smsc_retries = Counter('smsc_retries_total', 'SMSC API requests repeated on another mirror.', ('cmd', 'reason'))
+
+
+def render_metrics() -> str:
+    """Render all registered metrics.
+
+    Returns:
+        Metrics in Prometheus text format.
+    """
+    return '\n'.join(line for metric in registry for line in metric.render()) + '\n'
+
+
+def log_event(event: str, **fields) -> None:
+    """Log structured event as one JSON line.
+
+    Args:
+        event: event name.
+        fields: event fields.
+    """
+    logger.info(json.dumps({'event': event, 'ts': time(), **fields}, default=str))
+
+
+async def _handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Answer HTTP request with the metrics.
+
+    Args:
+        reader: client stream reader.
+        writer: client stream writer.
+    """
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        is_metrics_request = request_line.split(b' ')[:2] == [b'GET', b'/metrics']
+        body = render_metrics().encode() if is_metrics_request else b'Not found\n'
+        status = '200 OK' if is_metrics_request else '404 Not Found'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode() + body,
+        )
+        await writer.drain()
+    except (OSError, asyncio.IncompleteReadError) as request_error:
+        logger.debug(f'Metrics request failed: {request_error!r}')
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(
+    host: str = METRICS_HOST, port: Optional[int] = METRICS_PORT,
+) -> Optional[asyncio.Server]:
+    """Serve metrics on /metrics path of the local HTTP endpoint.
+
+    Args:
+        host: interface to listen on.
+        port: port to listen on, the endpoint is disabled when None.
+
+    Returns:
+        Started server or None when disabled or the port is taken.
+    """
+    if port is None:
+        return None
+    try:
+        server = await asyncio.start_server(_handle_metrics_request, host, port)
+    except OSError as bind_error:
+        logger.warning(f'Metrics are not served, cannot listen on {host}:{port}: {bind_error!r}')
+        return None
+    logger.info(f'Metrics are served on http://{host}:{port}/metrics')
+    return server
+
+
+def _escape(label_value: str) -> str:
+    """Escape label value.
+
+    Args:
+        label_value: raw label value.
+
+    Returns:
+        Label value safe for Prometheus text format.
+    """
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
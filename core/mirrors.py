@@ -0,0 +1,95 @@
+"""Module with health and latency tracking of SMSC API mirrors."""
+
+from time import monotonic
+from typing import Optional
+
+from core.settings import (
+    SMSC_HEDGE_LATENCY_FACTOR, SMSC_HEDGE_MIN_DELAY, SMSC_MIRROR_COOLDOWN, SMSC_MIRROR_EWMA_ALPHA,
+    SMSC_MIRROR_MAX_COOLDOWN,
+)
+
+SMSC_HOSTS = ('smsc.ru', 'www1.smsc.ru', 'www2.smsc.ru', 'www3.smsc.ru', 'www4.smsc.ru', 'www5.smsc.ru')
+
+
+class MirrorState(object):
+    """Latency and health of one mirror."""
+
+    def __init__(self, host: str, priority: int) -> None:
+        """Initialize MirrorState object.
+
+        Args:
+            host: mirror host name.
+            priority: position of the mirror in the default order.
+        """
+        self.host = host
+        self.priority = priority
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+
+class MirrorSelector(object):
+    """Selector ordering mirrors by health and exponentially weighted average latency."""
+
+    def __init__(self, hosts: tuple[str, ...] = SMSC_HOSTS) -> None:
+        """Initialize MirrorSelector object.
+
+        Args:
+            hosts: mirror host names in the default order.
+        """
+        self.mirrors = {host: MirrorState(host, priority) for priority, host in enumerate(hosts)}
+
+    def ordered_hosts(self) -> list[str]:
+        """Order mirrors to try.
+
+        Returns:
+            Healthy mirrors from the fastest one, mirrors without measurements in default order after the measured
+            ones, then unhealthy mirrors from the one recovering first.
+        """
+        now = monotonic()
+        healthy_mirrors = [mirror for mirror in self.mirrors.values() if mirror.unhealthy_until <= now]
+        unhealthy_mirrors = [mirror for mirror in self.mirrors.values() if mirror.unhealthy_until > now]
+        healthy_mirrors.sort(key=lambda mirror: (mirror.latency is None, mirror.latency or 0, mirror.priority))
+        unhealthy_mirrors.sort(key=lambda mirror: mirror.unhealthy_until)
+        return [mirror.host for mirror in healthy_mirrors + unhealthy_mirrors]
+
+    def record_success(self, host: str, latency: float) -> None:
+        """Update mirror latency and mark it healthy.
+
+        Args:
+            host: mirror host name.
+            latency: request duration in seconds.
+        """
+        mirror = self.mirrors[host]
+        if mirror.latency is None:
+            mirror.latency = latency
+        else:
+            mirror.latency = SMSC_MIRROR_EWMA_ALPHA * latency + (1 - SMSC_MIRROR_EWMA_ALPHA) * mirror.latency
+        mirror.failures = 0
+        mirror.unhealthy_until = 0
+
+    def record_failure(self, host: str) -> None:
+        """Mark mirror unhealthy for a cooldown growing with consecutive failures.
+
+        Args:
+            host: mirror host name.
+        """
+        mirror = self.mirrors[host]
+        mirror.failures += 1
+        cooldown = min(SMSC_MIRROR_COOLDOWN * 2 ** (mirror.failures - 1), SMSC_MIRROR_MAX_COOLDOWN)
+        mirror.unhealthy_until = monotonic() + cooldown
+
+    def hedge_delay(self, host: str) -> float:
+        """Get time after which a hedged request to the next mirror is sent.
+
+        Args:
+            host: host name of the mirror answering the first request.
+
+        Returns:
+            Delay in seconds.
+        """
+        latency = self.mirrors[host].latency
+        return max(SMSC_HEDGE_MIN_DELAY, (latency or 0) * SMSC_HEDGE_LATENCY_FACTOR)
+
+
+mirror_selector = MirrorSelector()
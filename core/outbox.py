@@ -0,0 +1,447 @@
+"""Module with durable outbox of SMS segments handed from Telegram harvesting to sending."""
+
+import sqlite3
+from collections import Counter
+from time import time
+from typing import Iterable, NamedTuple, Optional, Sequence
+
+from core.choices import SegmentStatus
+from core.settings import OUTBOX_DB_PATH, OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETENTION_SECONDS
+
+
+class Segment(NamedTuple):
+    """Claimed outbox segment."""
+
+    segment_id: int
+    dialog: str
+    position: int
+    body: str
+    attempts: int
+    source_at: Optional[float] = None
+    receiver: Optional[str] = None
+    dialog_id: Optional[int] = None
+    provider_id: Optional[str] = None
+
+
+class PendingSegment(NamedTuple):
+    """Outbox segment waiting to be claimed."""
+
+    segment_id: int
+    dialog: str
+    position: int
+    body: str
+    priority: int
+    created_at: float
+    receiver: Optional[str] = None
+    dialog_id: Optional[int] = None
+    source_at: Optional[float] = None
+
+
+class Outbox(object):
+    """WAL-mode SQLite queue of pending SMS segments read by claim with lease."""
+
+    def __init__(
+        self,
+        db_path: str = OUTBOX_DB_PATH,
+        lease_seconds: float = OUTBOX_LEASE_SECONDS,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        retention_seconds: float = OUTBOX_RETENTION_SECONDS,
+    ) -> None:
+        """Initialize Outbox object.
+
+        Args:
+            db_path: path to SQLite database file.
+            lease_seconds: time after which a claimed but not finished segment can be claimed again.
+            max_attempts: number of send attempts after which a segment is marked as failed.
+            retention_seconds: time since enqueue after which sent and failed segments are purged.
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.connection = sqlite3.connect(db_path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS segments ('
+            'id INTEGER PRIMARY KEY, dialog TEXT NOT NULL, position INTEGER NOT NULL, body TEXT NOT NULL, '
+            f"status TEXT NOT NULL DEFAULT '{SegmentStatus.pending.value}', attempts INTEGER NOT NULL DEFAULT 0, "
+            'provider_id TEXT, lease_until REAL, created_at REAL NOT NULL, priority INTEGER NOT NULL DEFAULT 0, '
+            'source_at REAL, receiver TEXT, turn INTEGER NOT NULL DEFAULT 0, dialog_id INTEGER)',
+        )
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(segments)')}
+        for column, definition in (
+            ('priority', 'INTEGER NOT NULL DEFAULT 0'), ('source_at', 'REAL'), ('receiver', 'TEXT'),
+            ('turn', 'INTEGER NOT NULL DEFAULT 0'), ('dialog_id', 'INTEGER'),
+        ):
+            if column not in columns:
+                self.connection.execute(f'ALTER TABLE segments ADD COLUMN {column} {definition}')
+        if 'turn' not in columns:
+            self.connection.execute(
+                'UPDATE segments SET turn = ranked.turn FROM ('
+                'SELECT id, ROW_NUMBER() OVER (PARTITION BY dialog, receiver ORDER BY id) AS turn FROM segments '
+                'WHERE status IN (?, ?)) AS ranked WHERE segments.id = ranked.id',
+                (SegmentStatus.pending.value, SegmentStatus.claimed.value),
+            )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS segments_status ON segments (status, id)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS segments_claim ON segments (status, priority DESC, turn, id)',
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS segments_dialog_turn ON segments (dialog_id, dialog, receiver, turn)',
+        )
+
+    def enqueue(
+        self,
+        dialog: str,
+        bodies: Iterable[str],
+        priority: int = 0,
+        first_position: int = 0,
+        source_at: Optional[float] = None,
+        receivers: Sequence[Optional[str]] = (None,),
+        dialog_id: Optional[int] = None,
+    ) -> int:
+        """Add segments of the dialog in one transaction, one copy per receiver.
+
+        Every copy gets the turn it is claimed in: the turn after the last unfinished segment of the dialog and
+        receiver, but not before the earliest pending turn of the priority class, so a dialog with new messages
+        joins the current round instead of overtaking dialogs with a backlog.
+        Dialogs are told apart by id, the title is only displayed, so chats with the same name do not share turns.
+
+        Args:
+            dialog: dialog title.
+            bodies: segment texts in sending order.
+            priority: priority class of the dialog, higher priority segments are claimed first.
+            first_position: position of the first segment when the dialog is appended in parts.
+            source_at: timestamp of the oldest Telegram message the segments are made of.
+            receivers: receiver phone numbers, None stands for the configured receiver.
+            dialog_id: marked dialog id, segments without it are told apart by the title.
+
+        Returns:
+            Number of added segments per receiver.
+        """
+        created_at = time()
+        bodies = list(bodies)
+        with self._transaction():
+            current_turn = self.connection.execute(
+                'SELECT MIN(turn) FROM segments WHERE status = ? AND priority = ?',
+                (SegmentStatus.pending.value, priority),
+            ).fetchone()[0] or 0
+            rows: list[tuple] = []
+            for receiver in receivers:
+                last_turn = self.connection.execute(
+                    'SELECT MAX(turn) FROM segments WHERE dialog_id IS ? AND (dialog_id IS NOT NULL OR dialog = ?) '
+                    'AND receiver IS ? AND status IN (?, ?)',
+                    (dialog_id, dialog, receiver, SegmentStatus.pending.value, SegmentStatus.claimed.value),
+                ).fetchone()[0]
+                first_turn = current_turn if last_turn is None else max(last_turn + 1, current_turn)
+                rows.extend(
+                    (dialog, position, body, created_at, priority, source_at, receiver, first_turn + index, dialog_id)
+                    for index, (position, body) in enumerate(enumerate(bodies, first_position))
+                )
+            rows.sort(key=lambda row: row[7])
+            self.connection.executemany(
+                'INSERT INTO segments '
+                '(dialog, position, body, created_at, priority, source_at, receiver, turn, dialog_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+        return len(bodies) if receivers else 0
+
+    def claim(self, limit: int, receivers: Optional[Sequence[Optional[str]]] = None) -> list[Segment]:
+        """Lease pending segments, including segments with expired leases, in scheduling order.
+
+        Higher priority classes go first. Within a class dialogs take turns assigned on enqueue, one segment of
+        every dialog per receiver per round, and segments of one dialog keep their order. Copies of a segment bound
+        for different receivers are claimed next to each other. Segments with expired leases are returned to the
+        queue first, so the claim itself is an index range scan.
+
+        Args:
+            limit: maximum number of segments to claim.
+            receivers: receivers whose segments are claimed, segments of all receivers are claimed when not passed.
+
+        Returns:
+            Claimed segments in sending order.
+        """
+        now = time()
+        with self._transaction():
+            self.connection.execute(
+                'UPDATE segments SET status = ?, lease_until = NULL WHERE status = ? AND lease_until < ?',
+                (SegmentStatus.pending.value, SegmentStatus.claimed.value, now),
+            )
+            receiver_filter = ''
+            if receivers is not None:
+                receiver_filter = f' AND ({" OR ".join(["receiver IS ?"] * len(receivers)) or "0"})'
+            rows = self.connection.execute(
+                'SELECT id, dialog, position, body, attempts, source_at, receiver, dialog_id FROM segments '
+                f'WHERE status = ?{receiver_filter} ORDER BY priority DESC, turn, id LIMIT ?',
+                (SegmentStatus.pending.value, *(receivers or ()), limit),
+            ).fetchall()
+            self.connection.executemany(
+                'UPDATE segments SET status = ?, attempts = attempts + 1, lease_until = ? WHERE id = ?',
+                [(SegmentStatus.claimed.value, now + self.lease_seconds, row[0]) for row in rows],
+            )
+        return [
+            Segment(segment_id, dialog, position, body, attempts + 1, source_at, receiver, dialog_id)
+            for segment_id, dialog, position, body, attempts, source_at, receiver, dialog_id in rows
+        ]
+
+    def pending_segments(self) -> list[PendingSegment]:
+        """List segments that can be claimed, including segments with expired leases.
+
+        Returns:
+            Pending segments in enqueue order.
+        """
+        rows = self.connection.execute(
+            'SELECT id, dialog, position, body, priority, created_at, receiver, dialog_id, source_at FROM segments '
+            'WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY id',
+            (SegmentStatus.pending.value, SegmentStatus.claimed.value, time()),
+        ).fetchall()
+        return [PendingSegment(*row) for row in rows]
+
+    def unknown_segments(self) -> list[Segment]:
+        """List segments of send requests that failed after they were written.
+
+        Returns:
+            Segments with the message id they were sent under in enqueue order.
+        """
+        rows = self.connection.execute(
+            'SELECT id, dialog, position, body, attempts, source_at, receiver, dialog_id, provider_id FROM segments '
+            'WHERE status = ? ORDER BY id',
+            (SegmentStatus.unknown.value,),
+        ).fetchall()
+        return [Segment(*row) for row in rows]
+
+    def pending_receivers(self) -> list[Optional[str]]:
+        """List receivers of segments that can be claimed, including segments with expired leases.
+
+        Returns:
+            Receiver phone numbers, None stands for the configured receiver.
+        """
+        return [
+            row[0] for row in self.connection.execute(
+                'SELECT DISTINCT receiver FROM segments WHERE status = ? OR (status = ? AND lease_until < ?)',
+                (SegmentStatus.pending.value, SegmentStatus.claimed.value, time()),
+            )
+        ]
+
+    def skip(self, segment_ids: Iterable[int]) -> None:
+        """Mark segments as skipped so they are never sent.
+
+        Args:
+            segment_ids: outbox segment ids.
+        """
+        with self._transaction():
+            self.connection.executemany(
+                'UPDATE segments SET status = ?, lease_until = NULL WHERE id = ?',
+                [(SegmentStatus.skipped.value, segment_id) for segment_id in segment_ids],
+            )
+
+    def still_claimed(self, segments: Iterable[Segment]) -> list[Segment]:
+        """Filter segments that are claimed and not finished yet.
+
+        Args:
+            segments: claimed segments.
+
+        Returns:
+            Segments still in claimed status in the passed order.
+        """
+        return self._with_status(segments, SegmentStatus.claimed)
+
+    def released(self, segments: Iterable[Segment]) -> list[Segment]:
+        """Filter claimed segments returned to the queue after a failed attempt.
+
+        Args:
+            segments: claimed segments.
+
+        Returns:
+            Segments in pending status in the passed order.
+        """
+        return self._with_status(segments, SegmentStatus.pending)
+
+    def mark_sent(self, segment_id: int, provider_id: Optional[str]) -> None:
+        """Mark segment as accepted by the provider.
+
+        Args:
+            segment_id: outbox segment id.
+            provider_id: message id assigned by the provider.
+        """
+        self._set_status(segment_id, SegmentStatus.sent, provider_id)
+
+    def mark_delivered(self, segment_id: int, provider_id: Optional[str]) -> None:
+        """Mark segment as delivered to the receiver.
+
+        Args:
+            segment_id: outbox segment id.
+            provider_id: message id assigned by the provider.
+        """
+        self._set_status(segment_id, SegmentStatus.delivered, provider_id)
+
+    def release(self, segment_id: int, status: SegmentStatus = SegmentStatus.claimed) -> None:
+        """Return segment to the queue or mark it as failed when attempts are exhausted.
+
+        Args:
+            segment_id: outbox segment id.
+            status: status the segment is released from, claimed or unknown.
+        """
+        with self._transaction():
+            self.connection.execute(
+                'UPDATE segments SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_until = NULL '
+                'WHERE id = ? AND status = ?',
+                (self.max_attempts, SegmentStatus.failed.value, SegmentStatus.pending.value, segment_id, status.value),
+            )
+
+    def mark_unknown(self, segment_ids: Iterable[int], provider_id: str) -> None:
+        """Keep claimed segments out of the queue until it is known whether their send request reached SMSC.
+
+        Args:
+            segment_ids: outbox segment ids.
+            provider_id: message id the segments were sent under.
+        """
+        with self._transaction():
+            self.connection.executemany(
+                'UPDATE segments SET status = ?, provider_id = ?, lease_until = NULL WHERE id = ? AND status = ?',
+                [
+                    (SegmentStatus.unknown.value, provider_id, segment_id, SegmentStatus.claimed.value)
+                    for segment_id in segment_ids
+                ],
+            )
+
+    def postpone(self, segment_ids: Iterable[int]) -> None:
+        """Return claimed segments to the queue without counting the attempt.
+
+        Args:
+            segment_ids: outbox segment ids.
+        """
+        with self._transaction():
+            self.connection.executemany(
+                'UPDATE segments SET status = ?, attempts = MAX(attempts - 1, 0), lease_until = NULL '
+                'WHERE id = ? AND status = ?',
+                [
+                    (SegmentStatus.pending.value, segment_id, SegmentStatus.claimed.value)
+                    for segment_id in segment_ids
+                ],
+            )
+
+    def fail(self, segment_id: int) -> None:
+        """Mark segment as failed without further attempts.
+
+        Args:
+            segment_id: outbox segment id.
+        """
+        self._set_status(segment_id, SegmentStatus.failed, None)
+
+    def purge(self) -> int:
+        """Delete segments that reached the receiver or were skipped over budget, and expired sent and failed ones.
+
+        Only paced mode confirms delivery, so segments accepted by the provider are kept for the retention period
+        like failed segments, which stay countable until then.
+
+        Returns:
+            Number of deleted segments.
+        """
+        with self._transaction():
+            cursor = self.connection.execute(
+                'DELETE FROM segments WHERE status IN (?, ?) OR (status IN (?, ?) AND created_at < ?)',
+                (
+                    SegmentStatus.delivered.value, SegmentStatus.skipped.value, SegmentStatus.sent.value,
+                    SegmentStatus.failed.value, time() - self.retention_seconds,
+                ),
+            )
+        return cursor.rowcount
+
+    def pending_count(self) -> int:
+        """Count segments waiting to be sent.
+
+        Returns:
+            Number of pending, claimed and unknown segments.
+        """
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM segments WHERE status IN (?, ?, ?)',
+            (SegmentStatus.pending.value, SegmentStatus.claimed.value, SegmentStatus.unknown.value),
+        ).fetchone()[0]
+
+    def status_counts(self) -> Counter[SegmentStatus]:
+        """Count segments in every status.
+
+        Returns:
+            Number of segments per status, statuses without segments are missing.
+        """
+        return Counter({
+            SegmentStatus(status): count
+            for status, count in self.connection.execute('SELECT status, COUNT(*) FROM segments GROUP BY status')
+        })
+
+    def close(self) -> None:
+        """Close database connection."""
+        self.connection.close()
+
+    def _with_status(self, segments: Iterable[Segment], status: SegmentStatus) -> list[Segment]:
+        """Filter segments in the status.
+
+        Args:
+            segments: outbox segments.
+            status: segment status.
+
+        Returns:
+            Segments in the status in the passed order.
+        """
+        segments = list(segments)
+        segment_ids = {
+            row[0] for row in self.connection.execute(
+                f'SELECT id FROM segments WHERE status = ? AND id IN ({", ".join("?" * len(segments))})',
+                (status.value, *(segment.segment_id for segment in segments)),
+            )
+        }
+        return [segment for segment in segments if segment.segment_id in segment_ids]
+
+    def _set_status(self, segment_id: int, status: SegmentStatus, provider_id: Optional[str]) -> None:
+        """Set final status of the segment.
+
+        Args:
+            segment_id: outbox segment id.
+            status: new segment status.
+            provider_id: message id assigned by the provider.
+        """
+        with self._transaction():
+            self.connection.execute(
+                'UPDATE segments SET status = ?, provider_id = ?, lease_until = NULL WHERE id = ?',
+                (status.value, provider_id, segment_id),
+            )
+
+    def _transaction(self) -> '_Transaction':
+        """Begin immediate transaction.
+
+        Returns:
+            Context manager committing or rolling back the transaction.
+        """
+        return _Transaction(self.connection)
+
+
+class _Transaction(object):
+    """Context manager of an immediate SQLite transaction."""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        """Initialize _Transaction object.
+
+        Args:
+            connection: connection in autocommit mode.
+        """
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        """Begin transaction taking the write lock immediately.
+
+        Returns:
+            Database connection.
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        """Commit transaction or roll it back on error.
+
+        Args:
+            exc_type: exception type.
+            exc_info: exception value and traceback.
+        """
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
@@ -0,0 +1,54 @@
+"""Module with token bucket limiting the rate of sent SMS."""
+
+import asyncio
+from time import monotonic
+
+
+class TokenBucket(object):
+    """Token bucket refilled at a constant rate, waiting callers are served in arrival order."""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        """Initialize TokenBucket object with the full bucket.
+
+        Args:
+            rate: number of tokens added per second.
+            capacity: maximum number of accumulated tokens, i.e. the allowed burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, messages_per_minute: float, burst: int) -> 'TokenBucket':
+        """Create bucket from the provider limit.
+
+        Args:
+            messages_per_minute: number of messages allowed per minute.
+            burst: number of messages allowed to be sent at once.
+
+        Returns:
+            TokenBucket instance.
+        """
+        return cls(messages_per_minute / 60, max(burst, 1))
+
+    async def acquire(self, tokens: int = 1) -> None:
+        """Take tokens, waiting until the bucket is refilled when there is not enough of them.
+
+        Requests for more tokens than the capacity are allowed and wait for the whole deficit.
+
+        Args:
+            tokens: number of tokens to take.
+        """
+        async with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+    def _refill(self) -> None:
+        """Add tokens accumulated since the last update."""
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
@@ -1,43 +1,75 @@
 """Module for scheduling functionality."""
 
 import asyncio
-import os
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from core.classes import SMSController, TelegramController
-from core.settings import POLL_DAYS_INTERVAL, SENDING_DELTA_HOURS, TG_MESSAGES_DIR
+from core.choices import SegmentStatus
+from core.classes import SMSController
+from core.connection import stop_connection_managers
+from core.fanout import poll_all_accounts
+from core.metrics import outbox_failed, start_metrics_server
+from core.outbox import Outbox
+from core.settings import POLL_DAYS_INTERVAL
+
+logger = logging.getLogger('core.scheduling')
 
 scheduler = AsyncIOScheduler()
-polling_start_date = datetime.now()
-sending_start_date = polling_start_date + timedelta(hours=SENDING_DELTA_HOURS)
-cleaning_start_date = sending_start_date + timedelta(hours=SENDING_DELTA_HOURS)
+pipeline_lock = asyncio.Lock()
 
 
-@scheduler.scheduled_job(trigger='interval', days=POLL_DAYS_INTERVAL, start_date=polling_start_date)
 async def poll_messages() -> None:
-    """Poll and save unread messages from Telegram."""
-    tg_controller = TelegramController()
-    await tg_controller.save_unread_messages()
+    """Poll and save unread messages of all Telegram accounts."""
+    await poll_all_accounts()
 
 
-@scheduler.scheduled_job(trigger='interval', days=POLL_DAYS_INTERVAL, start_date=sending_start_date)
-def send_messages() -> None:
+async def send_messages() -> None:
     """Send Telegram messages via SMS."""
     sms_controller = SMSController()
-    sms_controller.send_messages()
+    try:
+        await sms_controller.send_messages()
+    finally:
+        await sms_controller.close()
 
 
-@scheduler.scheduled_job(trigger='interval', days=POLL_DAYS_INTERVAL, start_date=cleaning_start_date)
 def clean_messages() -> None:
-    """Clean tg messages dir."""
-    for filename in os.listdir(TG_MESSAGES_DIR):
-        file_path = os.path.join(TG_MESSAGES_DIR, filename)
-        os.remove(file_path)
+    """Purge finished segments from the outbox, reporting failed ones kept for the retention period."""
+    outbox = Outbox()
+    try:
+        purged_count = outbox.purge()
+        failed_count = outbox.status_counts()[SegmentStatus.failed]
+    finally:
+        outbox.close()
+    outbox_failed.set(failed_count)
+    logger.info(f'Purged {purged_count} outbox segments')
+    if failed_count:
+        logger.warning(f'{failed_count} outbox segments failed for good and are kept until purged')
+
+
+@scheduler.scheduled_job(
+    trigger='interval', days=POLL_DAYS_INTERVAL, next_run_time=datetime.now(), max_instances=1, coalesce=True,
+)
+async def run_pipeline() -> None:
+    """Poll messages, send them as soon as polling completes and clean the outbox after sending finishes.
+
+    A run started while the previous one is still in progress is skipped.
+    """
+    if pipeline_lock.locked():
+        logger.warning('Previous pipeline run is still in progress, run skipped')
+        return
+    async with pipeline_lock:
+        try:
+            await poll_messages()
+        except Exception as poll_error:
+            logger.exception(f'Polling failed, sending already saved messages: {poll_error!r}')
+        await send_messages()
+        clean_messages()
 
 
 async def main():
+    metrics_server = await start_metrics_server()
     scheduler.start()
     try:
         while True:
@@ -46,6 +78,9 @@ async def main():
         pass
     finally:
         scheduler.shutdown()
+        await stop_connection_managers()
+        if metrics_server is not None:
+            metrics_server.close()
 
 
 if __name__ == '__main__':
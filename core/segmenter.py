@@ -0,0 +1,241 @@
+"""Module with encoding-aware splitting of texts to concatenated SMS messages."""
+
+from typing import Iterable, Iterator
+
+from core.choices import SMSEncoding
+from core.settings import SMS_MAX_SEGMENTS_PER_MESSAGE, SMS_WORD_BOUNDARY_LOOKBEHIND
+
+GSM7_BASIC_CHARS = frozenset(
+    '@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+    '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà',
+)
+GSM7_EXTENSION_CHARS = frozenset('\f^{}\\[~]|€')
+GSM7_CHARS = GSM7_BASIC_CHARS | GSM7_EXTENSION_CHARS
+
+SINGLE_SEGMENT_UNITS = {SMSEncoding.gsm7: 160, SMSEncoding.ucs2: 70}
+MULTIPART_SEGMENT_UNITS = {SMSEncoding.gsm7: 153, SMSEncoding.ucs2: 67}
+
+TRANSLIT_TABLE = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'j', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'shh', 'ъ': '"', 'ы': 'y', 'ь': "'",
+    'э': "e'", 'ю': 'yu', 'я': 'ya',
+}
+PUNCTUATION_TABLE = {
+    '«': '"', '»': '"', '„': '"', '“': '"', '”': '"', '‘': "'", '’': "'", '–': '-', '—': '-', '−': '-',
+    '…': '...', '\u00a0': ' ', '\u2009': ' ', '\u202f': ' ', '№': 'N',
+}
+TRANSLIT_MAPPING = str.maketrans({
+    **TRANSLIT_TABLE,
+    **{char.upper(): latin.capitalize() for char, latin in TRANSLIT_TABLE.items()},
+    **PUNCTUATION_TABLE,
+})
+
+
+def transliterate(text: str) -> str:
+    """Transliterate cyrillic letters and typographic punctuation the way SMSC translit mode does.
+
+    Args:
+        text: source text.
+
+    Returns:
+        Transliterated text.
+    """
+    return text.translate(TRANSLIT_MAPPING)
+
+
+def detect_encoding(text: str) -> SMSEncoding:
+    """Detect the encoding SMS with the text is sent in.
+
+    Args:
+        text: message text.
+
+    Returns:
+        GSM 7-bit encoding if every char is representable in it, otherwise UCS-2.
+    """
+    return SMSEncoding.gsm7 if GSM7_CHARS.issuperset(text) else SMSEncoding.ucs2
+
+
+def char_units(char: str, encoding: SMSEncoding) -> int:
+    """Count encoding units the char takes.
+
+    Args:
+        char: single char.
+        encoding: SMS encoding.
+
+    Returns:
+        Number of septets for GSM 7-bit or UTF-16 code units for UCS-2.
+    """
+    if encoding == SMSEncoding.gsm7:
+        return 2 if char in GSM7_EXTENSION_CHARS else 1
+    return 2 if ord(char) > 0xFFFF else 1
+
+
+def text_units(text: str, encoding: SMSEncoding) -> int:
+    """Count encoding units the text takes without iterating its chars in Python.
+
+    Args:
+        text: message text.
+        encoding: SMS encoding.
+
+    Returns:
+        Number of septets for GSM 7-bit or UTF-16 code units for UCS-2.
+    """
+    if encoding == SMSEncoding.gsm7:
+        return len(text) + sum(map(text.count, GSM7_EXTENSION_CHARS))
+    return len(text.encode('utf-16-le')) // 2
+
+
+def count_segments(text: str) -> int:
+    """Count billed segments of the SMS with the text.
+
+    Args:
+        text: message text.
+
+    Returns:
+        Number of segments of the concatenated SMS.
+    """
+    if not text:
+        return 0
+    encoding = detect_encoding(text)
+    units = text_units(text, encoding)
+    if units <= SINGLE_SEGMENT_UNITS[encoding]:
+        return 1
+    segment_units = MULTIPART_SEGMENT_UNITS[encoding]
+    if units == len(text):
+        return -(-units // segment_units)
+    segments_count, filled_units = 1, 0
+    for char in text:
+        units = char_units(char, encoding)
+        if filled_units + units > segment_units:
+            segments_count, filled_units = segments_count + 1, 0
+        filled_units += units
+    return segments_count
+
+
+def _prefix_end(text: str, start: int, encoding: SMSEncoding, max_segments: int) -> int:
+    """Find the end of the longest text prefix fitting into max_segments segments of the encoding.
+
+    Args:
+        text: whole text.
+        start: prefix start index.
+        encoding: SMS encoding of the prefix.
+        max_segments: maximum number of concatenated segments.
+
+    Returns:
+        Prefix end index.
+    """
+    single_units, segment_units = SINGLE_SEGMENT_UNITS[encoding], MULTIPART_SEGMENT_UNITS[encoding]
+    total_units, segments_count, filled_units = 0, 1, 0
+    single_end = multipart_end = start
+    for index in range(start, len(text)):
+        char = text[index]
+        if encoding == SMSEncoding.gsm7 and char not in GSM7_BASIC_CHARS and char not in GSM7_EXTENSION_CHARS:
+            break
+        units = char_units(char, encoding)
+        total_units += units
+        if total_units <= single_units:
+            single_end = index + 1
+        if filled_units + units > segment_units:
+            segments_count, filled_units = segments_count + 1, 0
+        if segments_count > max_segments:
+            break
+        filled_units += units
+        multipart_end = index + 1
+    return max(single_end, multipart_end if max_segments > 1 else start)
+
+
+def _message_spans(text: str, max_segments: int) -> Iterator[tuple[int, int]]:
+    """Find bounds of the messages the transliterated text is split to.
+
+    Args:
+        text: transliterated text without leading whitespace.
+        max_segments: maximum number of concatenated segments of one message.
+
+    Yields:
+        Start and end index of every message, messages may have trailing whitespace.
+    """
+    start = 0
+    while start < len(text):
+        end = max(
+            _prefix_end(text, start, SMSEncoding.gsm7, max_segments),
+            _prefix_end(text, start, SMSEncoding.ucs2, max_segments),
+        )
+        if end < len(text):
+            lookbehind_start = max(start + 1, end - SMS_WORD_BOUNDARY_LOOKBEHIND)
+            boundary = max(text.rfind('\n', lookbehind_start, end), text.rfind(' ', lookbehind_start, end))
+            if boundary > start:
+                end = boundary
+        yield start, end
+        start = end
+        while start < len(text) and text[start] in ' \n':
+            start += 1
+
+
+def split_to_messages(text: str, max_segments: int = SMS_MAX_SEGMENTS_PER_MESSAGE) -> list[str]:
+    """Split text to the smallest number of messages of at most max_segments concatenated segments.
+
+    Text is transliterated first, messages are cut at line breaks or spaces when it wastes little space.
+
+    Args:
+        text: text to be split.
+        max_segments: maximum number of concatenated segments of one message.
+
+    Returns:
+        Message texts in sending order.
+    """
+    text = transliterate(text).strip()
+    messages = (text[start:end].strip() for start, end in _message_spans(text, max_segments))
+    return [message for message in messages if message]
+
+
+class MessageSplitter(object):
+    """Incremental split_to_messages of texts joined by line breaks, keeping only the not yet split tail."""
+
+    def __init__(self, max_segments: int = SMS_MAX_SEGMENTS_PER_MESSAGE) -> None:
+        """Initialize MessageSplitter object.
+
+        Args:
+            max_segments: maximum number of concatenated segments of one message.
+        """
+        self.max_segments = max_segments
+        self.lookahead = max(
+            SINGLE_SEGMENT_UNITS[SMSEncoding.gsm7], max_segments * MULTIPART_SEGMENT_UNITS[SMSEncoding.gsm7],
+        ) + 1
+        self._tail = ''
+
+    def feed(self, texts: Iterable[str]) -> Iterator[str]:
+        """Add texts and split the messages that can not change with further texts.
+
+        Args:
+            texts: texts in sending order.
+
+        Yields:
+            Complete message texts in sending order.
+        """
+        for text in texts:
+            text = transliterate(text)
+            self._tail = f'{self._tail}\n{text}' if self._tail else text.lstrip()
+            if len(self._tail) <= 2 * self.lookahead:
+                continue
+            tail_start = len(self._tail)
+            for start, end in _message_spans(self._tail, self.max_segments):
+                if len(self._tail) - start <= self.lookahead:
+                    tail_start = start
+                    break
+                message = self._tail[start:end].strip()
+                if message:
+                    yield message
+            self._tail = self._tail[tail_start:]
+
+    def finish(self) -> Iterator[str]:
+        """Split the rest of the texts.
+
+        Yields:
+            Remaining message texts in sending order.
+        """
+        tail, self._tail = self._tail.rstrip(), ''
+        for start, end in _message_spans(tail, self.max_segments):
+            message = tail[start:end].strip()
+            if message:
+                yield message
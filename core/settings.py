@@ -3,15 +3,70 @@
 import os
 from pathlib import Path
 
+from core.choices import SendingMode, SendingTransport
+
 POLL_DAYS_INTERVAL = 3
-SENDING_DELTA_HOURS = 6
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 CONFIG_FILE_PATH = os.path.join(BASE_DIR, 'config.yaml')
-TG_MESSAGES_DIR = os.path.join(BASE_DIR, 'telegram_messages')
-os.makedirs(TG_MESSAGES_DIR, exist_ok=True)
+STORAGE_DIR = os.path.join(BASE_DIR, 'storage')
+os.makedirs(STORAGE_DIR, exist_ok=True)
+STATE_DB_PATH = os.path.join(STORAGE_DIR, 'state.sqlite3')
+OUTBOX_DB_PATH = os.path.join(STORAGE_DIR, 'outbox.sqlite3')
 
 CLIENT_SESSION_FILE_NAME = 'session'
+DEFAULT_ACCOUNT_NAME = 'default'
+FANOUT_MAX_WORKERS = os.cpu_count() or 1
 CLIENT_SYSTEM_VERSION = '4.16.30-vxCUSTOM'
-SMS_SYMBOLS_COUNT_LIMIT = 150
+SMS_MAX_SEGMENTS_PER_MESSAGE = 4
+SMS_WORD_BOUNDARY_LOOKBEHIND = 20
 MESSAGE_DELIVERY_TIME = 20
+SMSC_MAX_CONNECTIONS = 4
+SMSC_CONNECT_TIMEOUT = 5
+SMSC_READ_TIMEOUT = 20
+SMSC_MIRROR_EWMA_ALPHA = 0.3
+SMSC_MIRROR_COOLDOWN = 30
+SMSC_MIRROR_MAX_COOLDOWN = 600
+SMSC_HEDGE_MIN_DELAY = 1
+SMSC_HEDGE_LATENCY_FACTOR = 3
+SMS_SENDING_MODE = SendingMode.batch
+SMSC_BATCH_MAX_MESSAGES = 50
+SMS_TRANSPORT = SendingTransport.http
+SMS_SMTP_FALLBACK = True
+SMTP_PORT = 25
+SMTP_TIMEOUT = 20
+SMTP_MAX_MESSAGES_PER_CONNECTION = 100
+SMS_RATE_PER_MINUTE = 60
+SMS_RATE_BURST = 10
+SMS_DEFAULT_PRIORITY = 0
+SMS_CYCLE_MAX_SEGMENTS = None
+SMS_CYCLE_MAX_COST = None
+SMS_COST_CACHE_SECONDS = 24 * 60 * 60
+DELIVERY_POLL_INITIAL_DELAY = 2
+DELIVERY_POLL_MAX_DELAY = 30
+DELIVERY_POLL_BACKOFF_FACTOR = 1.5
+DELIVERY_TIMEOUT = MESSAGE_DELIVERY_TIME * 6
+HARVEST_CONCURRENCY = 8
+HARVEST_BUFFER_MESSAGES = 100
+DIALOG_INDEX_FULL_SCAN_SECONDS = 24 * 60 * 60
+FLOOD_WAIT_MAX_RETRIES = 3
+LIVE_BATCH_WINDOW_SECONDS = 60
+OUTBOX_LEASE_SECONDS = 600
+OUTBOX_MAX_ATTEMPTS = 3
+OUTBOX_RETENTION_SECONDS = 7 * 24 * 60 * 60
+COMPACTION_STAGE_NAMES = (
+    'drop_media', 'strip_markdown', 'shorten_links', 'strip_emoji', 'normalize_whitespace', 'strip_signatures',
+    'dedupe_lines',
+)
+COMPACTION_DEDUPE_MIN_LINE_LENGTH = 20
+COMPACTION_SIGNATURE_MIN_LINE_LENGTH = 20
+COMPACTION_MAX_REMEMBERED_LINES = 10000
+DEDUP_CACHE_SIZE = 50000
+DEDUP_MIN_TEXT_LENGTH = 20
+DEDUP_BACK_REFERENCE = True
+TG_RECONNECT_INITIAL_DELAY = 1
+TG_RECONNECT_MAX_DELAY = 300
+TG_BORROW_TIMEOUT = 120
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+LIVE_METRICS_PORT = 9109
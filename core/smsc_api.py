@@ -3,23 +3,24 @@
 
 import smtplib
 from datetime import datetime
+from time import monotonic
 
-from core.choices import SMSApiDataKeys, YamlConfigKeys
-from core.classes import YamlFileAdapter
-from core.settings import CONFIG_FILE_PATH
+from core.config import get_config
+from core.exceptions import SMSCRequestSentError, SMSCTransientError
+from core.metrics import smsc_request_errors, smsc_request_seconds
+from core.mirrors import mirror_selector
+from core.settings import SMSC_READ_TIMEOUT
 
 try:
 	from urllib import urlopen, quote
+	from urllib2 import HTTPError, URLError
 except ImportError:
 	from urllib.request import urlopen
 	from urllib.parse import quote
-
-config_settings = YamlFileAdapter(CONFIG_FILE_PATH).read()
-smsc_api_data = config_settings[YamlConfigKeys.smsc_api_data]
+	from urllib.error import HTTPError, URLError
 
 # Константы для настройки библиотеки
-SMSC_LOGIN = smsc_api_data[SMSApiDataKeys.login]  # логин клиента
-SMSC_PASSWORD = smsc_api_data[SMSApiDataKeys.password]  # пароль
+# логин и пароль клиента читаются из config.yaml при каждом запросе, см. smsc_credentials()
 SMSC_POST = False				# использовать метод POST
 SMSC_HTTPS = False				# использовать HTTPS протокол
 SMSC_CHARSET = "utf-8"			# кодировка сообщения (windows-1251 или koi8-r), по умолчанию используется utf-8
@@ -31,6 +32,13 @@ SMTP_SERVER = "send.smsc.ru"	# адрес smtp сервера
 SMTP_LOGIN = ""					# логин для smtp сервера
 SMTP_PASSWORD = ""				# пароль для smtp сервера
 
+# Логин и пароль клиента из закэшированного конфига
+
+def smsc_credentials():
+	smsc_api_data = get_config().smsc_api_data
+	return smsc_api_data.login, smsc_api_data.password
+
+
 # Вспомогательная функция, эмуляция тернарной операции ?:
 def ifs(cond, val1, val2):
 	if cond:
@@ -67,7 +75,7 @@ class SMSC(object):
 		m = self._smsc_send_cmd("send", "cost=3&phones=" + quote(phones) + "&mes=" + quote(message) + \
 					"&translit=" + str(translit) + "&id=" + str(id) + ifs(format > 0, "&" + formats[format-1], "") + \
 					ifs(sender == False, "", "&sender=" + quote(str(sender))) + \
-					ifs(time, "&time=" + quote(time), "") + ifs(query, "&" + query, ""))
+					ifs(time, "&time=" + quote(time), "") + ifs(query, "&" + query, ""), idempotent=False)
 
 		# (id, cnt, cost, balance) или (id, -error)
 
@@ -80,6 +88,26 @@ class SMSC(object):
 		return m
 
 
+	# Метод пакетной отправки SMS в режиме list
+	#
+	# messages - список пар (<телефон>, <сообщение>), все сообщения уходят одним запросом
+	#
+	# необязательные параметры:
+	#
+	# translit - переводить или нет в транслит (1,2 или 0)
+	# sender - имя отправителя (Sender ID)
+	#
+	# возвращает список SendResult (<id>, <телефон>, <количество sms>, <стоимость>, <код ошибки>) по каждому сообщению
+
+	def send_sms_list(self, messages, translit=0, sender=False):
+		from core.async_smsc import build_sms_list, parse_sms_list_response
+
+		ret = self._smsc_read("send", "fmt=3&charset=" + SMSC_CHARSET + "&cost=3&op=1&list=" + quote(build_sms_list(messages)) + \
+					"&translit=" + str(translit) + ifs(sender == False, "", "&sender=" + quote(str(sender))), post=True, idempotent=False)
+
+		return parse_sms_list_response(ret, messages)
+
+
 	# SMTP версия метода отправки SMS
 
 	def send_sms_mail(self, phones, message, translit=0, time="", id=0, format=0, sender=""):
@@ -91,8 +119,10 @@ class SMSC(object):
 		if SMTP_LOGIN:
 			server.login(SMTP_LOGIN, SMTP_PASSWORD) 
 
+		login, password = smsc_credentials()
+
 		server.sendmail(SMTP_FROM, "send@send.smsc.ru", "Content-Type: text/plain; charset=" + SMSC_CHARSET + "\n\n" + \
-							SMSC_LOGIN + ":" + SMSC_PASSWORD + ":" + str(id) + ":" + time + ":" + str(translit) + "," + \
+							login + ":" + password + ":" + str(id) + ":" + time + ":" + str(translit) + "," + \
 							str(format) + "," + sender + ":" + phones + ":" + message)
 		server.quit()
 
@@ -185,40 +215,65 @@ class SMSC(object):
 
 	# ВНУТРЕННИЕ МЕТОДЫ
 
-	# Метод вызова запроса. Формирует URL и делает 3 попытки чтения
+	# Метод вызова запроса. Возвращает ответ сервера, разбитый по запятым
 
-	def _smsc_send_cmd(self, cmd, arg=""):
-		url = ifs(SMSC_HTTPS, "https", "http") + "://smsc.ru/sys/" + cmd + ".php"
-		_url = url
-		arg = "login=" + quote(SMSC_LOGIN) + "&psw=" + quote(SMSC_PASSWORD) + "&fmt=1&charset=" + SMSC_CHARSET + "&" + arg
+	def _smsc_send_cmd(self, cmd, arg="", idempotent=True):
+		ret = self._smsc_read(cmd, "fmt=1&charset=" + SMSC_CHARSET + "&" + arg, idempotent=idempotent)
 
-		i = 0
-		ret = ""
+		return ret.split(",")
 
-		while ret == "" and i <= 5:
-			if i > 0:
-				url = _url.replace("smsc.ru/", "www" + str(i) + ".smsc.ru/")
-			else:
-				i += 1
+	# Метод чтения ответа сервера. Перебирает зеркала smsc.ru от самого быстрого исправного,
+	# при недоступности всех зеркал выбрасывает SMSCTransientError.
+	# Неидемпотентные команды (отправка сообщений) переходят на следующее зеркало только при ошибке соединения,
+	# ошибка после отправки запроса выбрасывает SMSCRequestSentError, чтобы не отправить сообщение дважды
+
+	def _smsc_read(self, cmd, arg, post=False, idempotent=True):
+		login, password = smsc_credentials()
+		arg = "login=" + quote(login) + "&psw=" + quote(password) + "&" + arg
+		errors = []
+
+		for host in mirror_selector.ordered_hosts():
+			url = ifs(SMSC_HTTPS, "https", "http") + "://" + host + "/sys/" + cmd + ".php"
+			started_at = monotonic()
 
 			try:
-				if SMSC_POST or len(arg) > 2000:
-					data = urlopen(url, arg.encode(SMSC_CHARSET))
+				if post or SMSC_POST or len(arg) > 2000:
+					data = urlopen(url, arg.encode(SMSC_CHARSET), timeout=SMSC_READ_TIMEOUT)
 				else:
-					data = urlopen(url + "?" + arg)
+					data = urlopen(url + "?" + arg, timeout=SMSC_READ_TIMEOUT)
 
 				ret = str(data.read().decode(SMSC_CHARSET))
-			except:
-				ret = ""
+			except (OSError, ValueError) as error:
+				mirror_selector.record_failure(host)
+				smsc_request_errors.inc(1, host, cmd)
+				errors.append(host + ": " + repr(error))
 
-			i += 1
+				if SMSC_DEBUG:
+					print("Ошибка чтения адреса: " + url)
 
-		if ret == "":
-			if SMSC_DEBUG:
-				print("Ошибка чтения адреса: " + url)
-			ret = "," # фиктивный ответ
+				# URLError без HTTP ответа означает, что запрос не был отправлен
+				if not idempotent and (isinstance(error, HTTPError) or not isinstance(error, (URLError, ValueError))):
+					raise SMSCRequestSentError("Ошибка после отправки запроса " + cmd + " на " + host + ": " + repr(error))
 
-		return ret.split(",")
+				continue
+
+			smsc_request_seconds.observe(monotonic() - started_at, host, cmd)
+
+			if ret == "":
+				mirror_selector.record_failure(host)
+				smsc_request_errors.inc(1, host, cmd)
+				errors.append(host + ": пустой ответ")
+
+				if not idempotent:
+					raise SMSCRequestSentError("Пустой ответ на запрос " + cmd + " от " + host)
+
+				continue
+
+			mirror_selector.record_success(host, monotonic() - started_at)
+
+			return ret
+
+		raise SMSCTransientError("Ошибка чтения адресов зеркал: " + "; ".join(errors))
 
 
 # Examples:
@@ -228,6 +283,7 @@ class SMSC(object):
 # smsc.send_sms("79999999999", "0605040B8423F0DC0601AE02056A0045C60C036D79736974652E72750001036D7973697465000101", format=5)
 # smsc.send_sms("79999999999", "", format=3)
 # r = smsc.get_sms_cost("79999999999", "Вы успешно зарегистрированы!")
+# r = smsc.send_sms_list([("79999999999", "test"), ("78888888888", "test2")])
 # smsc.send_sms_mail("79999999999", "test2", format=1)
 # r = smsc.get_status(12345, "79999999999")
 # print(smsc.get_balance())
@@ -0,0 +1,131 @@
+"""Module with SMSC SMTP sender keeping one session open for many messages."""
+
+import asyncio
+import logging
+import smtplib
+from typing import Optional
+
+from core.exceptions import SMSCAccountError, SMSCPermanentError, SMSCTransientError
+from core.settings import SMTP_MAX_MESSAGES_PER_CONNECTION, SMTP_PORT, SMTP_TIMEOUT
+from core.smsc_api import SMSC_CHARSET, SMTP_FROM, SMTP_LOGIN, SMTP_PASSWORD, SMTP_SERVER, smsc_credentials
+
+logger = logging.getLogger('core.smtp_transport')
+
+SMTP_RECIPIENT = 'send@send.smsc.ru'
+SMTP_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+SMTP_SESSION_ERRORS = (smtplib.SMTPAuthenticationError, smtplib.SMTPHeloError, smtplib.SMTPNotSupportedError)
+SMTP_MESSAGE_ERRORS = (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class SMTPTransport(object):
+    """Sender of SMS over SMSC SMTP gateway reusing one authenticated session, reconnecting when it breaks."""
+
+    def __init__(
+        self,
+        host: str = SMTP_SERVER,
+        port: int = SMTP_PORT,
+        timeout: float = SMTP_TIMEOUT,
+        max_messages_per_connection: int = SMTP_MAX_MESSAGES_PER_CONNECTION,
+    ) -> None:
+        """Initialize SMTPTransport object, the connection is opened on the first message.
+
+        Args:
+            host: SMTP server host name.
+            port: SMTP server port.
+            timeout: connection and response timeout in seconds.
+            max_messages_per_connection: number of messages after which the session is reopened.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_messages_per_connection = max_messages_per_connection
+        self._server: Optional[smtplib.SMTP] = None
+        self._sent_count = 0
+        self._lock = asyncio.Lock()
+
+    async def send_sms(self, phones: str, message: str, translit: int = 0, message_id: int = 0) -> None:
+        """Send SMS message over the open SMTP session.
+
+        Args:
+            phones: phone numbers separated by comma or semicolon.
+            message: message text.
+            translit: transliteration mode (0, 1 or 2).
+            message_id: message identifier later used for status requests.
+
+        Raises:
+            SMSCTransientError: server is unavailable or temporarily rejected the message.
+            SMSCPermanentError: server rejected the message.
+            SMSCAccountError: server rejected the greeting or the login, so no message can be sent.
+        """
+        login, password = smsc_credentials()
+        mail = (
+            f'Content-Type: text/plain; charset={SMSC_CHARSET}\n\n'
+            f'{login}:{password}:{message_id}::{translit},0,:{phones}:{message}'
+        )
+        async with self._lock:
+            await asyncio.to_thread(self._send_mail, mail.encode(SMSC_CHARSET))
+
+    async def close(self) -> None:
+        """Quit the SMTP session."""
+        async with self._lock:
+            await asyncio.to_thread(self._disconnect)
+
+    def _connect(self) -> smtplib.SMTP:
+        """Open and authenticate SMTP session unless the current one can be reused.
+
+        Returns:
+            Connected SMTP client.
+        """
+        if self._server is not None and self._sent_count >= self.max_messages_per_connection:
+            self._disconnect()
+        if self._server is None:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                server.ehlo_or_helo_if_needed()
+                if SMTP_LOGIN:
+                    server.login(SMTP_LOGIN, SMTP_PASSWORD)
+            except BaseException:
+                server.close()
+                raise
+            self._server, self._sent_count = server, 0
+            logger.info(f'SMTP session to {self.host} opened')
+        return self._server
+
+    def _disconnect(self) -> None:
+        """Quit the SMTP session ignoring errors of a broken connection."""
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except SMTP_CONNECTION_ERRORS + (smtplib.SMTPResponseException,):
+            server.close()
+
+    def _send_mail(self, mail: bytes) -> None:
+        """Send mail over the session, reconnecting once when the session turns out to be broken.
+
+        SMTP errors are OSError subclasses, so session and message errors are told apart before connection errors.
+
+        Args:
+            mail: encoded mail with SMSC message command.
+        """
+        for attempt in range(2):
+            try:
+                self._connect().sendmail(SMTP_FROM, SMTP_RECIPIENT, mail)
+            except SMTP_SESSION_ERRORS as session_error:
+                self._disconnect()
+                raise SMSCAccountError(f'SMTP server {self.host} rejected the session: {session_error!r}')
+            except smtplib.SMTPRecipientsRefused as refused_error:
+                raise SMSCPermanentError(f'SMTP server refused recipient: {refused_error.recipients}')
+            except SMTP_MESSAGE_ERRORS as response_error:
+                if response_error.smtp_code < 500:
+                    raise SMSCTransientError(f'SMTP server deferred message: {response_error!r}')
+                raise SMSCPermanentError(f'SMTP server rejected message: {response_error!r}')
+            except SMTP_CONNECTION_ERRORS as connection_error:
+                self._disconnect()
+                if attempt:
+                    raise SMSCTransientError(f'SMTP server {self.host} is unavailable: {connection_error!r}')
+                logger.warning(f'SMTP session to {self.host} broke, reconnecting: {connection_error!r}')
+            else:
+                self._sent_count += 1
+                return
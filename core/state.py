@@ -0,0 +1,168 @@
+"""Module with persistent harvesting state."""
+
+import sqlite3
+from time import time
+from typing import Iterable, NamedTuple, Optional
+
+from telethon.tl.custom import Dialog
+
+from core.settings import DIALOG_INDEX_FULL_SCAN_SECONDS, STATE_DB_PATH
+
+
+class WatermarkStore(object):
+    """SQLite store of the last harvested message id per dialog."""
+
+    def __init__(self, db_path: str = STATE_DB_PATH) -> None:
+        """Initialize WatermarkStore object.
+
+        Args:
+            db_path: path to SQLite database file.
+        """
+        self.connection = sqlite3.connect(db_path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS dialog_watermarks (dialog_id INTEGER PRIMARY KEY, message_id INTEGER)',
+            )
+
+    def get(self, dialog_id: int) -> Optional[int]:
+        """Get the last harvested message id of the dialog.
+
+        Args:
+            dialog_id: Telegram dialog id.
+
+        Returns:
+            Message id or None if the dialog was never harvested.
+        """
+        row = self.connection.execute(
+            'SELECT message_id FROM dialog_watermarks WHERE dialog_id = ?', (dialog_id,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, dialog_id: int, message_id: int) -> None:
+        """Move the dialog watermark forward.
+
+        Args:
+            dialog_id: Telegram dialog id.
+            message_id: id of the last harvested message.
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO dialog_watermarks (dialog_id, message_id) VALUES (?, ?) '
+                'ON CONFLICT (dialog_id) DO UPDATE SET message_id = MAX(message_id, excluded.message_id)',
+                (dialog_id, message_id),
+            )
+
+    def close(self) -> None:
+        """Close database connection."""
+        self.connection.close()
+
+
+class IndexedDialog(NamedTuple):
+    """Dialog state remembered by the previous poll."""
+
+    title: str
+    top_message_id: int
+
+
+class DialogIndex(object):
+    """SQLite index of dialog titles and top message ids used for differential polling."""
+
+    def __init__(
+        self, db_path: str = STATE_DB_PATH, full_scan_seconds: float = DIALOG_INDEX_FULL_SCAN_SECONDS,
+    ) -> None:
+        """Initialize DialogIndex object, loading the indexed dialogs.
+
+        Args:
+            db_path: path to SQLite database file.
+            full_scan_seconds: time after which all dialogs are checked again regardless of the index.
+        """
+        self.full_scan_seconds = full_scan_seconds
+        self.connection = sqlite3.connect(db_path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS dialog_index (dialog_id INTEGER PRIMARY KEY, title TEXT, '
+                'top_message_id INTEGER, updated_at REAL)',
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS dialog_index_scans '
+                '(id INTEGER PRIMARY KEY CHECK (id = 0), scanned_at REAL)',
+            )
+        self._dialogs = {
+            dialog_id: IndexedDialog(title, top_message_id)
+            for dialog_id, title, top_message_id in self.connection.execute(
+                'SELECT dialog_id, title, top_message_id FROM dialog_index',
+            )
+        }
+
+    def needs_full_scan(self) -> bool:
+        """Check whether the index is empty or the last full scan is too old to trust it.
+
+        Returns:
+            True if all dialogs have to be checked.
+        """
+        row = self.connection.execute('SELECT scanned_at FROM dialog_index_scans WHERE id = 0').fetchone()
+        return not self._dialogs or row is None or row[0] + self.full_scan_seconds < time()
+
+    def title(self, dialog_id: int) -> Optional[str]:
+        """Get the cached dialog title.
+
+        Args:
+            dialog_id: Telegram dialog id.
+
+        Returns:
+            Dialog title or None if the dialog is not indexed.
+        """
+        indexed_dialog = self._dialogs.get(dialog_id)
+        return indexed_dialog.title if indexed_dialog else None
+
+    def is_unchanged(self, dialog: Dialog) -> bool:
+        """Check whether the dialog got no messages since it was indexed.
+
+        Args:
+            dialog: dialog from the dialog list.
+
+        Returns:
+            True if the indexed top message id is the current one.
+        """
+        indexed_dialog = self._dialogs.get(dialog.id)
+        return indexed_dialog is not None and indexed_dialog.top_message_id == _top_message_id(dialog)
+
+    def update(self, dialogs: Iterable[Dialog], full_scan: bool = False) -> None:
+        """Index the current state of harvested dialogs.
+
+        Args:
+            dialogs: dialogs from the dialog list.
+            full_scan: whether the dialogs are the whole dialog list.
+        """
+        updated_at = time()
+        rows = []
+        for dialog in dialogs:
+            indexed_dialog = IndexedDialog(dialog.name, _top_message_id(dialog))
+            self._dialogs[dialog.id] = indexed_dialog
+            rows.append((dialog.id, *indexed_dialog, updated_at))
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO dialog_index (dialog_id, title, top_message_id, updated_at) '
+                'VALUES (?, ?, ?, ?)',
+                rows,
+            )
+            if full_scan:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO dialog_index_scans (id, scanned_at) VALUES (0, ?)', (updated_at,),
+                )
+
+    def close(self) -> None:
+        """Close database connection."""
+        self.connection.close()
+
+
+def _top_message_id(dialog: Dialog) -> int:
+    """Get id of the last message of the dialog.
+
+    Args:
+        dialog: dialog from the dialog list.
+
+    Returns:
+        Message id or 0 for dialog without messages.
+    """
+    return dialog.message.id if dialog.message else 0